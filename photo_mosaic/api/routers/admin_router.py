@@ -209,7 +209,7 @@ async def reset_segment(
 async def post_mosaic_segment_random(
     mosaic_id: str,
     quick_fill: bool = Form(
-        True, description="If enabled each uploaded image will be filled into 5 different segemnts"
+        True, description="If enabled each uploaded image will be filled into 5 different segments"
     ),
     file: UploadFile = File(..., description="A portrait image that shall be added to the mosaic."),
     api_key: APIKey = Depends(auth_service.admin_auth),
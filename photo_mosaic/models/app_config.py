@@ -21,6 +21,9 @@ class AppConfig(BaseSettings):
 
     # persistence config
     sqlite_path: str
+    sqlite_cache_size_kb: int = 65536
+    sqlite_mmap_size: int = 268435456
+    sqlite_synchronous: str = "NORMAL"
     uploaded_image_path: str
 
     # Mosaic config
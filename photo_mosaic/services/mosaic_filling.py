@@ -1,5 +1,6 @@
 from typing import List, Tuple
 
+import numpy as np
 from fastapi import HTTPException
 from PIL import ImageOps
 from PIL.Image import Image
@@ -25,6 +26,7 @@ from photo_mosaic.utils.image_processing import (
     LOW_BRIGHTNESS,
     MEDIUM_BRIGHTNESS,
     apply_filter,
+    apply_filter_np,
     bytes2pil,
     center_crop,
     get_brightness_category,
@@ -138,13 +140,13 @@ class MosaicFillingService:
         current_pixels = db.read_image_pixels(mosaic_id, IMAGE_PIXELS_CATEGORY_CURRENT)
         metadata = db.read_mosaic_metadata(mosaic_id)
 
+        resized_query_pixels = np.asarray(q_image.resize((metadata.segment_width, metadata.segment_height)))
         for seg in segments:
             # apply filter
             segment_data = orig_pixels.pixel_array[seg.y_min : seg.y_max, seg.x_min : seg.x_max]
-            resized_query_image = q_image.resize((metadata.segment_width, metadata.segment_height))
-            filtered_image = apply_filter(
-                portrait_image=resized_query_image,
-                filter_image=segment_data,
+            filtered_image = apply_filter_np(
+                portrait_pixels=resized_query_pixels,
+                filter_pixels=segment_data,
                 blend_value=metadata.mosaic_config.mosaic_blend_value,
             )
 
@@ -165,8 +167,9 @@ class MosaicFillingService:
                     if not s.filled:
                         s.fillable = True
                 neigh_segs.append(seg)
+                # written with executemany, the neighbour lookups of the next segments already see the changes
+                # (same connection), everything is committed at once below
                 db.upsert_segments(neigh_segs)
-                db.commit()
 
         # write current pixels back to db
         db.upsert_image_pixels(current_pixels)
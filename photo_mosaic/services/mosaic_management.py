@@ -1,8 +1,10 @@
 import json
 import random
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional, Tuple
 
+import numpy as np
 from fastapi import HTTPException
 from PIL.Image import Image
 
@@ -29,11 +31,14 @@ from photo_mosaic.utils.image_processing import (
     LOW_BRIGHTNESS,
     MEDIUM_BRIGHTNESS,
     adapt_brightness,
+    adapt_brightness_np,
     bytes2pil,
-    get_brightness_category,
     get_image_center,
+    get_segment_brightness_categories,
     get_segment_config,
+    np2bytes,
     np2pil,
+    np_thumbnail,
     pil2bytes,
     pil2np,
 )
@@ -71,8 +76,10 @@ class MosaicManagementService:
         )
         db.upsert_image_pixels(original_pixels)
 
-        # create current jpeg
-        bg_pil_image = adapt_brightness(image, config.mosaic_bg_brightness)
+        # create current jpeg (a brightness factor of 1.0 leaves the image unchanged)
+        bg_pil_image = image
+        if config.mosaic_bg_brightness != 1.0:
+            bg_pil_image = adapt_brightness(image, config.mosaic_bg_brightness)
         current_jpeg = RawImage(
             mosaic_id=metadata.id, category=RAW_IMAGE_CURRENT_JPEG, image_bytes=pil2bytes(bg_pil_image)
         )
@@ -155,13 +162,16 @@ class MosaicManagementService:
         Returns: A list of segment objects
 
         """
-        # calculate the center of the image
+        # calculate the center of the image (as a row/col lookup mask)
         row_min, col_min, row_max, col_max = get_image_center(metadata)
+        is_center = np.zeros((metadata.n_rows, metadata.n_cols), dtype=bool)
+        is_center[row_min : row_max + 1, col_min : col_max + 1] = True
         center = "center"
         edge = "edge"
         segments: dict = {center: {0: [], 1: [], 2: []}, edge: {0: [], 1: [], 2: []}}
 
         random_sort_keys = random.sample(range(metadata.n_cols * metadata.n_rows), metadata.n_cols * metadata.n_rows)
+        brightness_categories = get_segment_brightness_categories(pixels.pixel_array, metadata).tolist()
         # create segment data structures + determine brightness/location
         for c in range(metadata.n_cols):
             for r in range(metadata.n_rows):
@@ -174,19 +184,13 @@ class MosaicManagementService:
                     x_max=metadata.space_left + (c + 1) * metadata.segment_width,
                     y_min=metadata.space_top + r * metadata.segment_height,
                     y_max=metadata.space_top + (r + 1) * metadata.segment_height,
-                    brightness=-1,
+                    brightness=brightness_categories[r][c],
                     fillable=False,
                     filled=False,
                     is_start_segment=False,
                     random_sort_key=random_sort_keys.pop(0),
                 )
-                np_segment = pixels.pixel_array[new_seg.y_min : new_seg.y_max, new_seg.x_min : new_seg.x_max]
-                new_seg.brightness = get_brightness_category(np2pil(np_segment))
-
-                if row_min <= r <= row_max and col_min <= c <= col_max:
-                    position = center
-                else:
-                    position = edge
+                position = center if is_center[r, c] else edge
                 segments[position][new_seg.brightness].append(new_seg)
 
         # randomly select n segments for each brightness to be fillable (image center is prefered)
@@ -253,17 +257,11 @@ class MosaicManagementService:
         Returns: A list of dictionaries each containing id, index and title for a mosaic
 
         """
-        mosaic_list = db.read_mosaic_list()
-        results = []
-        for mosaic_id, index, title, active, filled, original in mosaic_list:
-            if (
-                (filter_by == "ACTIVE" and active)
-                or (filter_by == "FILLED" and filled)
-                or (filter_by == "ORIGINAL" and original)
-                or (filter_by == "ALL")
-            ):
-                results.append({"id": mosaic_id, "index": index, "title": title})
-        return results
+        filter_columns = {"ACTIVE": "active", "FILLED": "filled", "ORIGINAL": "original", "ALL": None}
+        if filter_by not in filter_columns:
+            return []
+        mosaic_list = db.read_filtered_mosaic_list(filter_columns[filter_by])
+        return [{"id": mosaic_id, "index": index, "title": title} for mosaic_id, index, title in mosaic_list]
 
     def delete_mosaic(self, mosaic_id: str):
         """
@@ -327,11 +325,11 @@ class MosaicManagementService:
         db.update_mosaic_metadata(metadata)
 
         # reset current image
-        orig_image_pil = np2pil(orig_pixels.pixel_array)
-        bg_pil_image = adapt_brightness(orig_image_pil, metadata.mosaic_config.mosaic_bg_brightness)
-        # type: ignore
-        current_pixels.pixel_array = pil2np(bg_pil_image)
+        current_pixels.pixel_array = adapt_brightness_np(
+            orig_pixels.pixel_array, metadata.mosaic_config.mosaic_bg_brightness
+        )  # type: ignore
         db.upsert_image_pixels(current_pixels)
+        bg_pil_image = np2pil(current_pixels.pixel_array)
         current_jpeg = RawImage(
             mosaic_id=metadata.id, category=RAW_IMAGE_CURRENT_JPEG, image_bytes=pil2bytes(bg_pil_image)
         )
@@ -401,15 +399,17 @@ class MosaicManagementService:
         orig_pixels = db.read_image_pixels(mosaic_id, IMAGE_PIXELS_CATEGORY_ORIGINAL)
         current_pixels = db.read_image_pixels(mosaic_id, IMAGE_PIXELS_CATEGORY_CURRENT)
         seg = db.get_segments(mosaic_id=mosaic_id, id=segment_id)[0]
-        bg_pil_image = adapt_brightness(np2pil(orig_pixels.pixel_array), metadata.mosaic_config.mosaic_bg_brightness)
 
         # reset segment
         seg.filled = False
         seg.fillable = True
         db.upsert_segments([seg])
 
-        # reset segment in current pixel np array
-        segment_pixels_new = pil2np(bg_pil_image)[seg.y_min : seg.y_max, seg.x_min : seg.x_max]
+        # reset segment in current pixel np array (only the segment's background needs to be recreated)
+        segment_pixels_new = adapt_brightness_np(
+            orig_pixels.pixel_array[seg.y_min : seg.y_max, seg.x_min : seg.x_max],
+            metadata.mosaic_config.mosaic_bg_brightness,
+        )
         current_pixels.pixel_array[seg.y_min : seg.y_max, seg.x_min : seg.x_max] = segment_pixels_new
         db.upsert_image_pixels(current_pixels)
 
@@ -455,18 +455,17 @@ class MosaicManagementService:
             segment_data = orig_pixels.pixel_array[seg.y_min : seg.y_max, seg.x_min : seg.x_max]
             current_pixels.pixel_array[seg.y_min : seg.y_max, seg.x_min : seg.x_max] = segment_data
         db.upsert_image_pixels(current_pixels)
-        cur_pil = np2pil(current_pixels.pixel_array)
         current_jpeg = RawImage(
             mosaic_id=metadata.id,
             category=RAW_IMAGE_CURRENT_JPEG,
-            image_bytes=pil2bytes(cur_pil),
+            image_bytes=np2bytes(current_pixels.pixel_array),
         )
         db.upsert_raw_image(current_jpeg)
 
         # update current image jpeg thumbnail
-        cur_pil.thumbnail((get_config().current_image_thumbnail_size, get_config().current_image_thumbnail_size))
+        cur_small = np_thumbnail(current_pixels.pixel_array, get_config().current_image_thumbnail_size)
         current_jpeg_small = RawImage(
-            mosaic_id=metadata.id, category=RAW_IMAGE_CURRENT_SMALL_JPEG, image_bytes=pil2bytes(cur_pil)
+            mosaic_id=metadata.id, category=RAW_IMAGE_CURRENT_SMALL_JPEG, image_bytes=np2bytes(cur_small)
         )
         db.upsert_raw_image(current_jpeg_small)
 
@@ -487,15 +486,16 @@ class MosaicManagementService:
         else:
             # no fillable mosaics are available -> clone all original mosaics and set the first of them as active
             # to ensure endless filling of mosaics
-            mosaic_list = db.read_mosaic_list()
-            original_mosaics = []
-            for m_id, _, _, _, _, original in mosaic_list:
-                if original:
-                    original_mosaics.append(m_id)
-            for i, m_id in enumerate(original_mosaics):
+            original_mosaics = [m_id for m_id, _, _ in db.read_filtered_mosaic_list("original")]
+            original_pixels = [
+                db.read_image_pixels(m_id, IMAGE_PIXELS_CATEGORY_ORIGINAL).pixel_array for m_id in original_mosaics
+            ]
+            # encode the originals in parallel (jpeg encoding releases the GIL), the db connection is bound to the
+            # current thread so the mosaics themselves are created sequentially
+            with ThreadPoolExecutor() as executor:
+                original_jpegs = list(executor.map(lambda pixels: pil2bytes(np2pil(pixels)), original_pixels))
+            for i, (m_id, original) in enumerate(zip(original_mosaics, original_jpegs)):
                 old_metadata = db.read_mosaic_metadata(m_id)
-                original = db.read_image_pixels(m_id, IMAGE_PIXELS_CATEGORY_ORIGINAL)
-                original = pil2bytes(np2pil(original.pixel_array))
                 new_id = mgmt_service.create_mosaic(original, old_metadata.mosaic_config)
 
                 new_metadata = db.read_mosaic_metadata(new_id)
@@ -511,20 +511,11 @@ class MosaicManagementService:
         Returns next fillable mosaic.
         If no fillable mosaic is found return None.
         """
-        mosaic_list = db.read_mosaic_list()
-        active_mosaics = []
-        fillable_mosaics = []
-        for mosaic_id, _, _, active, filled, _ in mosaic_list:
-            if not filled:
-                fillable_mosaics.append(mosaic_id)
-            if active:
-                active_mosaics.append(mosaic_id)
+        active_mosaics = db.read_active_mosaic_ids()
 
         if len(active_mosaics) == 0:
             # no active mosaic left -> find a fillable mosaic
-            if len(fillable_mosaics) > 0:
-                return fillable_mosaics[0]
-            return None
+            return db.read_first_fillable_mosaic_id()
 
         if len(active_mosaics) > 1:
             # Multiple active mosaic (this should never happen) -> change status so only the first one is active
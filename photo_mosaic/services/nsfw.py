@@ -1,18 +1,20 @@
 import logging
+import os
 from os.path import exists
+from typing import List
 
+import numpy as np
 import tensorflow as tf
 import tensorflow_hub as hub
 from PIL import Image
 
-from photo_mosaic.utils.image_processing import pil2np
-
 IMAGE_DIMS = (224, 224)
 DRAWINGS = 0
 HENTAI = 1
 NEUTRAL = 2
 PORN = 3
 SEXY = 4
+NSFW_CLASSES = [HENTAI, PORN, SEXY]
 FILTER_THRESHOLD = 0.7
 
 
@@ -25,7 +27,20 @@ class NSFWService:
         tf.get_logger().setLevel("ERROR")
         tf.autograph.set_verbosity(3)
         print("Loading NSFW tensorflow model...")
-        self.model = self._load_model(model_path)
+        self.model = None
+        self.interpreter = None
+        if model_path is not None and model_path.endswith(".tflite"):
+            # quantized model (see scripts/quantize_nsfw_model.py)
+            self.interpreter = self._load_tflite_model(model_path)
+        else:
+            self.model = self._load_model(model_path)
+            # traced inference function (the input signature allows any batch size without retracing)
+            self._infer = tf.function(
+                lambda batch: self.model(batch, training=False),
+                input_signature=[tf.TensorSpec((None, IMAGE_DIMS[0], IMAGE_DIMS[1], 3), tf.float32)],
+            )
+        # warm up (graph tracing/kernel selection) so the first upload does not pay for it
+        self._predict(np.zeros((1, IMAGE_DIMS[1], IMAGE_DIMS[0], 3), dtype=np.float32))
 
     @staticmethod
     def _load_model(model_path: str):
@@ -41,6 +56,21 @@ class NSFWService:
         model = tf.keras.models.load_model(model_path, custom_objects={"KerasLayer": hub.KerasLayer})
         return model
 
+    @staticmethod
+    def _load_tflite_model(model_path: str):
+        """
+        Load (INT8 quantized) tflite nsfw model
+        Args:
+            model_path: Path the .tflite file
+        Raises:
+            ValueError: If model does not exist.
+        """
+        if not exists(model_path):
+            raise ValueError("model_path must be a valid .tflite model file.")
+        interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=os.cpu_count())
+        interpreter.allocate_tensors()
+        return interpreter
+
     def image_is_nsfw(self, image: Image) -> bool:
         """
         For a given image run inference and check whether adult content class predictions exceed a
@@ -51,15 +81,48 @@ class NSFWService:
         Returns: True if contains adult content, False otherwise
 
         """
-        img = image.resize(IMAGE_DIMS, Image.NEAREST)
-        nd_image = pil2np(img).astype(float)
-        nd_image /= 255.0
-        nd_image = tf.expand_dims(nd_image, axis=0)
-        preds = self.model.predict(nd_image)[0]
+        return self.images_are_nsfw([image])[0]
 
-        if preds[HENTAI] + preds[PORN] + preds[SEXY] > FILTER_THRESHOLD:
+    def images_are_nsfw(self, images: List[Image]) -> List[bool]:
+        """
+        Run inference for a batch of images at once (amortizes the model call overhead) and check for each image
+        whether adult content class predictions exceed a defined threshold.
+        Args:
+            images: The PIL images to be checked
+
+        Returns: For each image True if it contains adult content, False otherwise
+
+        """
+        # single float32 batch buffer, the uint8 pixels are cast while being copied into it
+        nd_images = np.empty((len(images), IMAGE_DIMS[1], IMAGE_DIMS[0], 3), dtype=np.float32)
+        for i, image in enumerate(images):
+            nd_images[i] = np.asarray(image.resize(IMAGE_DIMS, Image.BILINEAR))
+        nd_images *= 1.0 / 255.0
+        return self._check_predictions(self._predict(nd_images))
+
+    @staticmethod
+    def _check_predictions(batch_preds: np.ndarray) -> List[bool]:
+        # one vectorized sum + compare over the whole batch
+        nsfw = batch_preds[:, NSFW_CLASSES].sum(axis=1) > FILTER_THRESHOLD
+
+        for preds in batch_preds[nsfw]:
             logging.warning(
-                "Attempted NSWF image upload {hentai:%s, porn:%s, sexy:%s}", preds[HENTAI], preds[PORN], preds[SEXY]
+                "Attempted NSWF image upload {hentai:%s, porn:%s, sexy:%s}",
+                preds[HENTAI],
+                preds[PORN],
+                preds[SEXY],
             )
-            return True
-        return False
+        return nsfw.tolist()
+
+    def _predict(self, batch: np.ndarray) -> np.ndarray:
+        if self.interpreter is None:
+            return self._infer(batch).numpy()
+
+        input_details = self.interpreter.get_input_details()[0]
+        output_details = self.interpreter.get_output_details()[0]
+        if tuple(input_details["shape"]) != batch.shape:
+            self.interpreter.resize_tensor_input(input_details["index"], batch.shape)
+            self.interpreter.allocate_tensors()
+        self.interpreter.set_tensor(input_details["index"], batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(output_details["index"])
@@ -1,14 +1,18 @@
 import io
+import logging
 import os
 import sqlite3
+import threading
 import time
-from typing import Dict, List, Tuple
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
 
 import numpy as np
 from fastapi import HTTPException
 
 from photo_mosaic.models.app_config import get_config
-from photo_mosaic.models.image_pixels import ImagePixels
+from photo_mosaic.models.image_pixels import IMAGE_PIXELS_CATEGORY_ORIGINAL, ImagePixels
 from photo_mosaic.models.mosaic_config import MosaicConfig
 from photo_mosaic.models.mosaic_metadata import MosaicMetadata
 from photo_mosaic.models.raw_image import RawImage
@@ -18,6 +22,57 @@ MOSAIC_METADATA_TABLE = "mosaic_metadata"
 SEGMENT_TABLE = "segments"
 RAW_IMAGE_TABLE = "raw_images"
 IMAGE_PIXELS_TABLE = "image_pixels"
+CACHED_STATEMENTS = 256
+RAW_IMAGE_CACHE_SIZE = 64
+ORIGINAL_PIXELS_CACHE_SIZE = 8
+SQLITE_SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+# statements of hot paths (built once, so every call reuses the compiled statement from the connection cache)
+_SQL_MOSAIC_EXISTS = f"""SELECT EXISTS(SELECT 1 FROM {MOSAIC_METADATA_TABLE} WHERE id=?);"""
+_SQL_SEGMENT_EXISTS = f"""SELECT EXISTS(SELECT 1 FROM {SEGMENT_TABLE} WHERE id=?);"""
+_SQL_READ_RAW_IMAGE = f"""SELECT image_bytes FROM {RAW_IMAGE_TABLE} WHERE mosaic_id=? AND category=?;"""
+_SQL_READ_IMAGE_PIXELS = f"""SELECT file_name, shape, dtype FROM {IMAGE_PIXELS_TABLE}
+    WHERE mosaic_id=? AND category=?;"""
+_SQL_READ_MOSAIC_METADATA = f"""SELECT title, num_segments, mosaic_background_brightness, mosaic_blend_value,
+    segment_blend_value, segment_blur_low, segment_blur_medium, segment_blur_high, idx, active, filled, original,
+    segment_width, segment_height, n_rows, n_cols, space_top, space_left FROM {MOSAIC_METADATA_TABLE}
+    WHERE id=?"""
+_SQL_DELETE_MOSAIC_METADATA = f"""DELETE FROM {MOSAIC_METADATA_TABLE} WHERE id=?;"""
+# the VALUES join returns a row for every brightness category (including the empty ones)
+_SQL_SEGMENT_STATS = f"""SELECT b.column1, COUNT(s.brightness) FROM (VALUES (0), (1), (2)) AS b
+    LEFT JOIN {SEGMENT_TABLE} AS s ON s.mosaic_id=? AND s.filled=0 AND s.brightness=b.column1
+    GROUP BY b.column1;"""
+_SQL_UPSERT_RAW_IMAGE = f"""INSERT OR REPLACE INTO {RAW_IMAGE_TABLE} (mosaic_id, category, image_bytes)
+    values (?, ?, ?)"""
+_SQL_UPSERT_IMAGE_PIXELS = f"""INSERT OR REPLACE INTO {IMAGE_PIXELS_TABLE} (mosaic_id, category, file_name, shape,
+    dtype) values (?, ?, ?, ?, ?)"""
+# upserts update existing rows in place (INSERT OR REPLACE deletes and re-inserts them, which changes the rowid and
+# fires ON DELETE CASCADE)
+_SQL_UPSERT_MOSAIC_METADATA_SET = """ON CONFLICT(id) DO UPDATE SET active=excluded.active, filled=excluded.filled,
+    original=excluded.original, segment_width=excluded.segment_width, segment_height=excluded.segment_height,
+    n_rows=excluded.n_rows, n_cols=excluded.n_cols, space_top=excluded.space_top, space_left=excluded.space_left,
+    title=excluded.title, num_segments=excluded.num_segments,
+    mosaic_background_brightness=excluded.mosaic_background_brightness,
+    mosaic_blend_value=excluded.mosaic_blend_value, segment_blend_value=excluded.segment_blend_value,
+    segment_blur_low=excluded.segment_blur_low, segment_blur_medium=excluded.segment_blur_medium,
+    segment_blur_high=excluded.segment_blur_high"""
+_SQL_INSERT_MOSAIC_METADATA = f"""INSERT INTO {MOSAIC_METADATA_TABLE} (id, active, filled, original, segment_width,
+    segment_height, n_rows, n_cols, space_top, space_left, title, num_segments, mosaic_background_brightness,
+    mosaic_blend_value, segment_blend_value, segment_blur_low, segment_blur_medium, segment_blur_high) values
+    (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    {_SQL_UPSERT_MOSAIC_METADATA_SET}"""
+_SQL_UPDATE_MOSAIC_METADATA = f"""INSERT INTO {MOSAIC_METADATA_TABLE} (id, idx, active, filled, original,
+    segment_width, segment_height, n_rows, n_cols, space_top, space_left, title, num_segments,
+    mosaic_background_brightness, mosaic_blend_value, segment_blend_value, segment_blur_low, segment_blur_medium,
+    segment_blur_high) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    {_SQL_UPSERT_MOSAIC_METADATA_SET}"""
+_SQL_UPSERT_SEGMENT = f"""INSERT INTO {SEGMENT_TABLE} (id, mosaic_id, row_idx, col_idx, x_min, x_max,
+    y_min, y_max, brightness, fillable, filled, is_start_segment, random_sort_key) values
+    (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET mosaic_id=excluded.mosaic_id, row_idx=excluded.row_idx, col_idx=excluded.col_idx,
+    x_min=excluded.x_min, x_max=excluded.x_max, y_min=excluded.y_min, y_max=excluded.y_max,
+    brightness=excluded.brightness, fillable=excluded.fillable, filled=excluded.filled,
+    is_start_segment=excluded.is_start_segment, random_sort_key=excluded.random_sort_key"""
 
 
 class SQLitePersistenceService:
@@ -32,28 +87,47 @@ class SQLitePersistenceService:
 
         self._path = os.path.join(path, "mosaic.db")
         self._connection = None
+        # file/cache cleanups that may only run once the open transaction is committed
+        self._after_commit = []
+        self._pixel_store = NPArrayFileStore(os.path.join(path, "pixels"))
+        # caches for the hot reads (the service runs as single process, so they are invalidated by the writes below),
+        # they only ever hold committed data
+        self._raw_image_cache = LRUCache(RAW_IMAGE_CACHE_SIZE)
+        self._original_pixels_cache = LRUCache(ORIGINAL_PIXELS_CACHE_SIZE)
 
     def connect(self):
         if not self._connection:
             if os.path.isfile(self._path):
-                self._connection = sqlite3.connect(self._path, detect_types=sqlite3.PARSE_DECLTYPES)
+                self._connection = sqlite3.connect(self._path, cached_statements=CACHED_STATEMENTS)
+                self._set_pragmas()
             else:
-                self._connection = sqlite3.connect(self._path, detect_types=sqlite3.PARSE_DECLTYPES)
+                self._connection = sqlite3.connect(self._path, cached_statements=CACHED_STATEMENTS)
+                self._set_pragmas()
                 self._init_db()
+            self._migrate_image_pixels()
+            self._create_indexes()
         return self._connection
 
     def commit(self):
         self._connection.commit()
+        actions = list(self._after_commit)
+        self._after_commit.clear()
+        for action in actions:
+            action()
 
     def disconnect(self):
         if self._connection:
             self._connection.close()
             self._connection = None
+        # closing rolls back the open transaction, so its file references and cache updates were never committed
+        self._after_commit.clear()
+        self._raw_image_cache.clear()
+        self._original_pixels_cache.clear()
 
     def mosaic_exists(self, mosaic_id: str) -> bool:
         con = self.connect()
         cur = con.cursor()
-        cur.execute(f"""SELECT EXISTS(SELECT 1 FROM {MOSAIC_METADATA_TABLE} WHERE id=?);""", (mosaic_id,))
+        cur.execute(_SQL_MOSAIC_EXISTS, (mosaic_id,))
         return bool(cur.fetchone()[0])
 
     def mosaic_count(self) -> int:
@@ -71,14 +145,40 @@ class SQLitePersistenceService:
         rows = cur.fetchall()
         return rows
 
+    def read_filtered_mosaic_list(self, filter_column: Optional[str] = None) -> List[Tuple[str, int, str]]:
+        """
+        Read id, idx and title of all mosaics (ordered by idx), optionally only of those for which the given
+        state column ("active", "filled" or "original") is set
+        """
+        query = f"""SELECT id, idx, title FROM {MOSAIC_METADATA_TABLE}"""
+        if filter_column is not None:
+            if filter_column not in ("active", "filled", "original"):
+                raise ValueError(f"Invalid filter column {filter_column}")
+            query += f" WHERE {filter_column}=1"
+        query += " ORDER BY idx;"
+        con = self.connect()
+        cur = con.cursor()
+        cur.execute(query)
+        return list(cur)
+
+    def read_active_mosaic_ids(self) -> List[str]:
+        con = self.connect()
+        cur = con.cursor()
+        cur.execute(f"""SELECT id FROM {MOSAIC_METADATA_TABLE} WHERE active=1 ORDER BY idx;""")
+        return [row[0] for row in cur]
+
+    def read_first_fillable_mosaic_id(self) -> Optional[str]:
+        con = self.connect()
+        cur = con.cursor()
+        cur.execute(f"""SELECT id FROM {MOSAIC_METADATA_TABLE} WHERE filled=0 ORDER BY idx LIMIT 1;""")
+        row = cur.fetchone()
+        return row[0] if row else None
+
     def insert_mosaic_metadata(self, metadata: MosaicMetadata):
         con = self.connect()
         cur = con.cursor()
         cur.execute(
-            f"""INSERT OR REPLACE INTO {MOSAIC_METADATA_TABLE} (id, active, filled,
-               original, segment_width, segment_height, n_rows, n_cols, space_top, space_left, title, num_segments,
-               mosaic_background_brightness, mosaic_blend_value, segment_blend_value, segment_blur_low,
-               segment_blur_medium, segment_blur_high) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            _SQL_INSERT_MOSAIC_METADATA,
             (
                 metadata.id,
                 metadata.active,
@@ -105,10 +205,7 @@ class SQLitePersistenceService:
         con = self.connect()
         cur = con.cursor()
         cur.execute(
-            f"""INSERT OR REPLACE INTO {MOSAIC_METADATA_TABLE} (id, idx, active, filled,
-            original, segment_width, segment_height, n_rows, n_cols, space_top, space_left, title, num_segments,
-            mosaic_background_brightness, mosaic_blend_value, segment_blend_value, segment_blur_low,
-            segment_blur_medium, segment_blur_high) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            _SQL_UPDATE_MOSAIC_METADATA,
             (
                 metadata.id,
                 metadata.idx,
@@ -135,10 +232,7 @@ class SQLitePersistenceService:
     def read_mosaic_metadata(self, mosaic_id: str, active_only: bool = False) -> MosaicMetadata:
         con = self.connect()
         cur = con.cursor()
-        query = f"""SELECT title, num_segments, mosaic_background_brightness, mosaic_blend_value, segment_blend_value,
-                segment_blur_low, segment_blur_medium, segment_blur_high, idx, active, filled, original,
-                segment_width, segment_height, n_rows, n_cols, space_top, space_left FROM {MOSAIC_METADATA_TABLE}
-                WHERE id=?"""
+        query = _SQL_READ_MOSAIC_METADATA
         if active_only:
             query += " AND active=1;"
         else:
@@ -147,10 +241,9 @@ class SQLitePersistenceService:
                 query,
                 (mosaic_id,),
             )
-        rows = cur.fetchall()
-        if len(rows) == 0:
+        row = cur.fetchone()
+        if row is None:
             raise HTTPException(status_code=404, detail=f"Mosaic {mosaic_id} does not exist.")
-        row = rows[0]
         config = MosaicConfig(
             title=row[0],
             num_segments=row[1],
@@ -177,116 +270,132 @@ class SQLitePersistenceService:
         )
 
     def delete_mosaic_metadata(self, mosaic_id: str):
-        # if exists:
+        # segments, raw images and image pixels rows are removed by the ON DELETE CASCADE constraints
         con = self.connect()
         cur = con.cursor()
-        cur.execute(f"""DELETE FROM {MOSAIC_METADATA_TABLE} WHERE id=?;""", (mosaic_id,))
+        cur.execute(_SQL_DELETE_MOSAIC_METADATA, (mosaic_id,))
+        self._evict_mosaic(mosaic_id)
+        # the pixel files are only removed once the deletion is committed (and entries cached by an upsert of the same
+        # transaction are evicted again)
+        self._after_commit.append(lambda: self._pixel_store.delete(mosaic_id))
+        self._after_commit.append(lambda: self._evict_mosaic(mosaic_id))
+
+    def _evict_mosaic(self, mosaic_id: str):
+        self._raw_image_cache.evict(lambda key: key[0] == mosaic_id)
+        self._original_pixels_cache.evict(lambda key: key == mosaic_id)
 
     def upsert_raw_image(self, raw_image: RawImage):
         con = self.connect()
         cur = con.cursor()
         cur.execute(
-            f"""INSERT OR REPLACE INTO {RAW_IMAGE_TABLE} (mosaic_id, category, image_bytes)
-            values (?, ?, ?)""",
+            _SQL_UPSERT_RAW_IMAGE,
             (
                 raw_image.mosaic_id,
                 raw_image.category,
-                sqlite3.Binary(raw_image.image_bytes),
+                raw_image.image_bytes,
             ),
         )
+        key = (raw_image.mosaic_id, raw_image.category)
+        self._raw_image_cache.evict(lambda k: k == key)
+        self._after_commit.append(lambda: self._raw_image_cache.put(key, raw_image.image_bytes))
 
     def read_raw_image(self, mosaic_id: str, category: int) -> RawImage:
+        image_bytes = self._raw_image_cache.get((mosaic_id, category))
+        if image_bytes is not None:
+            return RawImage.construct(mosaic_id=mosaic_id, category=category, image_bytes=image_bytes)
         con = self.connect()
         cur = con.cursor()
         cur.execute(
-            f"""SELECT image_bytes FROM {RAW_IMAGE_TABLE}
-        WHERE mosaic_id=? AND category=?;""",
+            _SQL_READ_RAW_IMAGE,
             (
                 mosaic_id,
                 category,
             ),
         )
-        rows = cur.fetchall()
+        row = cur.fetchone()
 
-        if len(rows) == 0:
+        if row is None:
             raise HTTPException(
                 status_code=404,
                 detail=f"No raw image exist for mosaic_id={mosaic_id} AND category={category} does not exist.",
             )
-        row = rows[0]
+        if not con.in_transaction:
+            # otherwise the row may contain uncommitted writes
+            self._raw_image_cache.put((mosaic_id, category), row[0])
         return RawImage(mosaic_id=mosaic_id, category=category, image_bytes=row[0])
 
     def upsert_image_pixels(self, image_pixels: ImagePixels):
+        # the pixel array itself is written to a new raw file, the db only holds the file reference + array layout
         con = self.connect()
         cur = con.cursor()
+        cur.execute(_SQL_READ_IMAGE_PIXELS, (image_pixels.mosaic_id, image_pixels.category))
+        row = cur.fetchone()
+        file_name = self._pixel_store.put(image_pixels.mosaic_id, image_pixels.category, image_pixels.pixel_array)
         cur.execute(
-            f"""INSERT OR REPLACE INTO {IMAGE_PIXELS_TABLE} (mosaic_id, category, pixel_array)
-            values (?, ?, ?)""",
+            _SQL_UPSERT_IMAGE_PIXELS,
             (
                 image_pixels.mosaic_id,
                 image_pixels.category,
-                image_pixels.pixel_array,
+                file_name,
+                ",".join(str(dim) for dim in image_pixels.pixel_array.shape),
+                image_pixels.pixel_array.dtype.str,
             ),
         )
+        if row is not None:
+            # the replaced file is still referenced by the committed db state until the commit
+            self._after_commit.append(lambda: self._pixel_store.delete_file(row[0]))
+        if image_pixels.category == IMAGE_PIXELS_CATEGORY_ORIGINAL:
+            self._original_pixels_cache.evict(lambda key: key == image_pixels.mosaic_id)
 
     def read_image_pixels(self, mosaic_id: str, category: int) -> ImagePixels:
+        if category == IMAGE_PIXELS_CATEGORY_ORIGINAL:
+            pixel_array = self._original_pixels_cache.get(mosaic_id)
+            if pixel_array is not None:
+                return ImagePixels.construct(mosaic_id=mosaic_id, category=category, pixel_array=pixel_array)
         con = self.connect()
         cur = con.cursor()
         cur.execute(
-            f"""SELECT pixel_array FROM {IMAGE_PIXELS_TABLE} WHERE mosaic_id=? AND category=?;""",
+            _SQL_READ_IMAGE_PIXELS,
             (
                 mosaic_id,
                 category,
             ),
         )
-        rows = cur.fetchall()
+        row = cur.fetchone()
 
-        if len(rows) == 0:
+        if row is None:
             raise HTTPException(
                 status_code=404,
                 detail=f"No raw image exists for mosaic_id={mosaic_id} " f"AND category={category}.",
             )
-        row = rows[0]
-        return ImagePixels(mosaic_id=mosaic_id, category=category, pixel_array=row[0])
+        file_name, shape, dtype = row
+        shape = tuple(int(dim) for dim in shape.split(","))
+        if category == IMAGE_PIXELS_CATEGORY_ORIGINAL:
+            # the original pixels are never changed after creation -> shared read-only mapping
+            pixel_array = self._pixel_store.get(file_name, shape, dtype, writeable=False)
+            if not con.in_transaction:
+                self._original_pixels_cache.put(mosaic_id, pixel_array)
+        else:
+            pixel_array = self._pixel_store.get(file_name, shape, dtype)
+        return ImagePixels.construct(mosaic_id=mosaic_id, category=category, pixel_array=pixel_array)
 
     def segment_exists(self, segment_id: str) -> bool:
         con = self.connect()
         cur = con.cursor()
-        cur.execute(f"""SELECT EXISTS(SELECT 1 FROM {SEGMENT_TABLE} WHERE id=?);""", (segment_id,))
+        cur.execute(_SQL_SEGMENT_EXISTS, (segment_id,))
         return bool(cur.fetchone()[0])
 
     def upsert_segment(self, seg: Segment):
-        con = self.connect()
-        cur = con.cursor()
-        cur.execute(
-            f"""INSERT OR REPLACE INTO {SEGMENT_TABLE} (id, mosaic_id, row_idx, col_idx, x_min, x_max, y_min, y_max,
-                        brightness, fillable, filled, is_start_segment, random_sort_key) values
-                        (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (
-                seg.id,
-                seg.mosaic_id,
-                seg.row_idx,
-                seg.col_idx,
-                seg.x_min,
-                seg.x_max,
-                seg.y_min,
-                seg.y_max,
-                seg.brightness,
-                int(seg.fillable),
-                int(seg.filled),
-                int(seg.is_start_segment),
-                int(seg.random_sort_key),
-            ),
-        )
+        self.upsert_segments([seg])
 
     def upsert_segments(self, segments: List[Segment]):
+        # executemany binds the statement once for all rows, the rows are written within the open transaction and
+        # persisted by the next commit()
         con = self.connect()
         cur = con.cursor()
-        for seg in segments:
-            cur.execute(
-                f"""INSERT OR REPLACE INTO {SEGMENT_TABLE} (id, mosaic_id, row_idx, col_idx, x_min, x_max, y_min, y_max,
-                brightness, fillable, filled, is_start_segment, random_sort_key) values
-                 (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        cur.executemany(
+            _SQL_UPSERT_SEGMENT,
+            [
                 (
                     seg.id,
                     seg.mosaic_id,
@@ -301,24 +410,19 @@ class SQLitePersistenceService:
                     int(seg.filled),
                     int(seg.is_start_segment),
                     int(seg.random_sort_key),
-                ),
-            )
+                )
+                for seg in segments
+            ],
+        )
 
     def get_segment_stats(self, mosaic_id: str) -> Dict[int, int]:
         con = self.connect()
         cur = con.cursor()
         cur.execute(
-            f"""SELECT brightness, COUNT(id) FROM {SEGMENT_TABLE}
-            WHERE mosaic_id=? AND filled=0 GROUP BY brightness;""",
+            _SQL_SEGMENT_STATS,
             (mosaic_id,),
         )
-        rows = cur.fetchall()
-
-        res_dict = {r[0]: r[1] for r in rows}
-        for brightness in [0, 1, 2]:
-            if brightness not in res_dict:
-                res_dict[brightness] = 0
-        return res_dict
+        return dict(cur)
 
     def get_segments(self, limit: int = -1, offset: int = 0, random_order: bool = False, **kwargs) -> List[Segment]:
         keys = [
@@ -342,26 +446,33 @@ class SQLitePersistenceService:
         for k, v in kwargs.items():
             if k in keys:
                 if isinstance(v, list):
-                    where_keys.append(f"{k} IN ?")
-                    where_values.append(v)
+                    placeholders = ", ".join("?" * len(v))
+                    where_keys.append(f"{k} IN ({placeholders})")
+                    where_values.extend(v)
                 else:
                     where_keys.append(f"{k}=?")
                     where_values.append(v)
-        query = f"SELECT {', '.join(keys)} FROM {SEGMENT_TABLE} WHERE {' AND '.join(where_keys)}"
+        query = f"SELECT {', '.join(keys)} FROM {SEGMENT_TABLE}"
+        if where_keys:
+            query += f" WHERE {' AND '.join(where_keys)}"
         if random_order:
             query += " ORDER BY random_sort_key ASC"
+        else:
+            # insertion order (as without the indexes), otherwise the order would depend on the chosen index
+            query += " ORDER BY rowid"
         if limit > 0:
-            query += f" LIMIT {limit}"
-            query += f" OFFSET {offset};"
+            # bound instead of formatted, so the statement cache can reuse the query for every limit/offset
+            query += " LIMIT ? OFFSET ?"
+            where_values.extend((limit, offset))
         con = self.connect()
         cur = con.cursor()
         cur.execute(query, where_values)
-        rows = cur.fetchall()
 
         segments = []
-        for row in rows:
+        for row in cur:
+            # rows come from our own schema, skip pydantic validation (only the bool columns need a cast)
             segments.append(
-                Segment(
+                Segment.construct(
                     id=row[0],
                     mosaic_id=row[1],
                     row_idx=row[2],
@@ -371,14 +482,37 @@ class SQLitePersistenceService:
                     y_min=row[6],
                     y_max=row[7],
                     brightness=row[8],
-                    fillable=row[9],
-                    filled=row[10],
-                    is_start_segment=row[11],
+                    fillable=bool(row[9]),
+                    filled=bool(row[10]),
+                    is_start_segment=bool(row[11]),
                     random_sort_key=row[12],
                 )
             )
         return segments
 
+    def _set_pragmas(self):
+        """
+        Tune the connection for the read/write pattern of the service: WAL lets readers proceed while writing,
+        synchronous=NORMAL (default of SQLITE_SYNCHRONOUS) removes the fsync from every commit (still safe in WAL
+        mode, OFF is only meant for throwaway dbs like the ones of the tests), the remaining settings
+        keep temp tables, pages and BLOB reads in memory. foreign_keys is off by default and enables the ON DELETE
+        CASCADE constraints of the schema.
+        """
+        cur = self._connection.cursor()
+        cur.execute("PRAGMA foreign_keys=ON;")
+        try:
+            # persistent setting of the db file, fails e.g. on file systems without shared memory support
+            cur.execute("PRAGMA journal_mode=WAL;")
+        except sqlite3.OperationalError as e:
+            logging.warning("Could not enable sqlite WAL mode: %s", e)
+        synchronous = get_config().sqlite_synchronous.upper()
+        if synchronous not in SQLITE_SYNCHRONOUS_MODES:
+            raise ValueError(f"SQLITE_SYNCHRONOUS has to be one of {SQLITE_SYNCHRONOUS_MODES}!")
+        cur.execute(f"PRAGMA synchronous={synchronous};")
+        cur.execute("PRAGMA temp_store=MEMORY;")
+        cur.execute(f"PRAGMA cache_size=-{int(get_config().sqlite_cache_size_kb)};")
+        cur.execute(f"PRAGMA mmap_size={int(get_config().sqlite_mmap_size)};")
+
     def _init_db(self):
         cur = self._connection.cursor()
         cur.execute(
@@ -417,17 +551,7 @@ class SQLitePersistenceService:
                               ON DELETE CASCADE)"""
         )
 
-        cur.execute(
-            f"""CREATE TABLE {IMAGE_PIXELS_TABLE}
-                           (mosaic_id TEXT,
-                            category INTEGER,
-                            pixel_array array,
-                            PRIMARY KEY (mosaic_id, category),
-                            CONSTRAINT fk_mosaic_id
-                              FOREIGN KEY (mosaic_id)
-                              REFERENCES {MOSAIC_METADATA_TABLE}(id)
-                              ON DELETE CASCADE)"""
-        )
+        self._create_image_pixels_table(cur)
 
         cur.execute(
             f"""CREATE TABLE {SEGMENT_TABLE}
@@ -452,24 +576,162 @@ class SQLitePersistenceService:
         )
         self.commit()
 
+    @staticmethod
+    def _create_image_pixels_table(cur: sqlite3.Cursor):
+        cur.execute(
+            f"""CREATE TABLE {IMAGE_PIXELS_TABLE}
+                           (mosaic_id TEXT,
+                            category INTEGER,
+                            file_name TEXT,
+                            shape TEXT,
+                            dtype TEXT,
+                            PRIMARY KEY (mosaic_id, category),
+                            CONSTRAINT fk_mosaic_id
+                              FOREIGN KEY (mosaic_id)
+                              REFERENCES {MOSAIC_METADATA_TABLE}(id)
+                              ON DELETE CASCADE)"""
+        )
+
+    def _migrate_image_pixels(self):
+        """
+        Move the pixel arrays of dbs created before the NPArrayFileStore (np.save BLOBs in a pixel_array column) into
+        pixel files. Runs in one transaction, so an interrupted migration is repeated on the next connect.
+        """
+        cur = self._connection.cursor()
+        cur.execute(f"PRAGMA table_info({IMAGE_PIXELS_TABLE});")
+        if "pixel_array" not in [column[1] for column in cur.fetchall()]:
+            return
+        logging.info("Migrating the pixel arrays of %s to pixel files", self._path)
+        cur.execute("BEGIN;")
+        cur.execute(f"ALTER TABLE {IMAGE_PIXELS_TABLE} RENAME TO {IMAGE_PIXELS_TABLE}_old;")
+        self._create_image_pixels_table(cur)
+        read_cur = self._connection.cursor()
+        read_cur.execute(f"SELECT mosaic_id, category, pixel_array FROM {IMAGE_PIXELS_TABLE}_old;")
+        for mosaic_id, category, blob in read_cur:
+            pixel_array = np.load(io.BytesIO(blob))
+            file_name = self._pixel_store.put(mosaic_id, category, pixel_array)
+            cur.execute(
+                _SQL_UPSERT_IMAGE_PIXELS,
+                (
+                    mosaic_id,
+                    category,
+                    file_name,
+                    ",".join(str(dim) for dim in pixel_array.shape),
+                    pixel_array.dtype.str,
+                ),
+            )
+        cur.execute(f"DROP TABLE {IMAGE_PIXELS_TABLE}_old;")
+        self.commit()
 
-def _write_np_array(array):
+    def _create_indexes(self):
+        # IF NOT EXISTS, so dbs created before an index was introduced get it on the next connect
+        cur = self._connection.cursor()
+        # covering index for get_segment_stats (GROUP BY without touching the table)
+        cur.execute(
+            f"""CREATE INDEX IF NOT EXISTS idx_segments_mosaic_filled_brightness
+                ON {SEGMENT_TABLE}(mosaic_id, filled, brightness)"""
+        )
+        # finish_mosaic (fillable, not yet filled segments)
+        cur.execute(
+            f"""CREATE INDEX IF NOT EXISTS idx_segments_mosaic_fillable_filled
+                ON {SEGMENT_TABLE}(mosaic_id, fillable, filled)"""
+        )
+        # random segment samples of the filling service (ORDER BY random_sort_key is read from the index)
+        cur.execute(
+            f"""CREATE INDEX IF NOT EXISTS idx_segments_mosaic_brightness_fillable_random
+                ON {SEGMENT_TABLE}(mosaic_id, brightness, fillable, random_sort_key)"""
+        )
+        # unfilled segments in random order for the gif animation
+        cur.execute(
+            f"""CREATE INDEX IF NOT EXISTS idx_segments_mosaic_filled_random
+                ON {SEGMENT_TABLE}(mosaic_id, filled, random_sort_key)"""
+        )
+        # active mosaic lookups (every fill request and mosaic state change)
+        cur.execute(f"""CREATE INDEX IF NOT EXISTS idx_mosaic_metadata_active ON {MOSAIC_METADATA_TABLE}(active)""")
+        # neighbour lookups of the filling service
+        cur.execute(
+            f"""CREATE INDEX IF NOT EXISTS idx_segments_mosaic_row_col
+                ON {SEGMENT_TABLE}(mosaic_id, row_idx, col_idx)"""
+        )
+        self.commit()
+
+
+class NPArrayFileStore:
     """
-    Serialize np array
+    Stores np arrays as raw binary files that are memory mapped on read.
+    (Avoids serializing multi-MB pixel arrays into db BLOBs and lets the OS page cache the arrays)
     """
-    byte_arr = io.BytesIO()
-    np.save(byte_arr, array)
-    byte_arr.seek(0)
-    return sqlite3.Binary(byte_arr.read())
-
 
-def _read_np_array(blob):
+    def __init__(self, path: str):
+        self._path = path
+
+    def put(self, mosaic_id: str, category: int, array: np.ndarray) -> str:
+        """
+        Write an array to a new file of the given mosaic/category (files referenced by the db are never overwritten,
+        so an uncommitted or failed transaction still finds the arrays of the committed state)
+        Args:
+            mosaic_id: The mosaic id
+            category: The image pixels category
+            array: The array to store
+
+        Returns: The name of the written file
+
+        """
+        os.makedirs(self._path, exist_ok=True)
+        file_name = f"{mosaic_id}_{category}_{uuid.uuid4().hex}.raw"
+        np.ascontiguousarray(array).tofile(os.path.join(self._path, file_name))
+        return file_name
+
+    def get(self, file_name: str, shape: Tuple[int, ...], dtype: str, writeable: bool = True) -> np.ndarray:
+        # copy-on-write mapping: changes to the array are only persisted by calling put()
+        mode = "c" if writeable else "r"
+        return np.memmap(os.path.join(self._path, file_name), dtype=np.dtype(dtype), mode=mode, shape=shape)
+
+    def delete_file(self, file_name: str):
+        # arrays that are still mapped from the file stay valid (the data is freed once the last mapping is closed)
+        file_path = os.path.join(self._path, file_name)
+        if os.path.isfile(file_path):
+            os.remove(file_path)
+
+    def delete(self, mosaic_id: str):
+        if os.path.isdir(self._path):
+            for file_name in os.listdir(self._path):
+                if file_name.startswith(f"{mosaic_id}_"):
+                    os.remove(os.path.join(self._path, file_name))
+
+
+class LRUCache:
     """
-    Deserialize np array
+    A small thread safe LRU cache
     """
-    byte_arr = io.BytesIO(blob)
-    byte_arr.seek(0)
-    return np.load(byte_arr)
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            if len(self._items) > self._max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def evict(self, predicate: Callable[[Hashable], bool]):
+        with self._lock:
+            for key in [k for k in self._items if predicate(k)]:
+                del self._items[key]
 
 
 class FilePersistenceService:
@@ -483,9 +745,5 @@ class FilePersistenceService:
             f_h.write(image)
 
 
-# register serialization/deserialization for np arrays
-sqlite3.register_adapter(np.ndarray, _write_np_array)
-sqlite3.register_converter("array", _read_np_array)
-
 # initialize SQLite Service
 db = SQLitePersistenceService(get_config().sqlite_path)
@@ -1,6 +1,8 @@
 import io
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
+from PIL import Image
 
 from photo_mosaic.models.app_config import get_config
 from photo_mosaic.models.image_pixels import (
@@ -9,7 +11,11 @@ from photo_mosaic.models.image_pixels import (
 )
 from photo_mosaic.models.raw_image import RAW_IMAGE_FILLING_GIF, RawImage
 from photo_mosaic.services.persistence import db
-from photo_mosaic.utils.image_processing import GIF_QUANTIZATION_METHOD, np2pil
+from photo_mosaic.utils.image_processing import (
+    GIF_QUANTIZATION_METHOD,
+    np2pil,
+    np_thumbnail,
+)
 
 
 def mosaic_2_gif(mosaic_id: str, n_frames_current_image: int = 5, n_frames_filling: int = 5) -> RawImage:
@@ -24,15 +30,23 @@ def mosaic_2_gif(mosaic_id: str, n_frames_current_image: int = 5, n_frames_filli
 
     """
     # Load raw images
-    gif_dims = (get_config().gif_image_max_size, get_config().gif_image_max_size)
+    gif_max_size = get_config().gif_image_max_size
     current_image = db.read_image_pixels(mosaic_id, IMAGE_PIXELS_CATEGORY_CURRENT).pixel_array
     original_image = db.read_image_pixels(mosaic_id, IMAGE_PIXELS_CATEGORY_ORIGINAL).pixel_array
 
-    # reduce raw image dims (to reduce gif size) and create frames for current state
-    current_image_small = np2pil(current_image).copy()
-    current_image_small.thumbnail(gif_dims)
-    current_image_small = current_image_small.quantize(method=GIF_QUANTIZATION_METHOD).convert("P")
-    sequence = [current_image_small] * n_frames_current_image
+    # reduce raw image dims once (to reduce gif size), all frames are rendered at gif resolution
+    height, width = original_image.shape[:2]
+    current_image = np_thumbnail(current_image, gif_max_size)
+    original_image = np_thumbnail(original_image, gif_max_size)
+    scale_y = original_image.shape[0] / height
+    scale_x = original_image.shape[1] / width
+
+    # every frame only contains pixels of the current state and the original image -> a single palette computed
+    # from both fits all frames
+    palette_image = np2pil(np.vstack([current_image, original_image])).quantize(method=GIF_QUANTIZATION_METHOD)
+
+    # frame pixels of the filling process (the first one is the current state)
+    frames = [current_image.copy()]
 
     # Get segments of the mosaic that have not been filled yet
     segments = db.get_segments(random_order=True, mosaic_id=mosaic_id, filled=0)
@@ -44,21 +58,30 @@ def mosaic_2_gif(mosaic_id: str, n_frames_current_image: int = 5, n_frames_filli
         # select a subset of segments
         segs = segments[i : min(i + n, len(segments))]
 
-        # add them to the current state of the mosaic (based on the original image)
-        orig_mask = np.zeros(original_image.shape, dtype="uint8")
+        # add them to the current state of the mosaic (based on the original image), the segment rectangles (scaled
+        # to gif resolution) are copied in place (current_image is a copy-on-write mapping or a resized copy, so the
+        # stored pixels are not changed)
         for s in segs:
-            orig_mask[s.y_min : s.y_max, s.x_min : s.x_max, :] = 1
-        current_image = np.where(orig_mask == 1, original_image, current_image)
+            y_min, y_max = round(s.y_min * scale_y), round(s.y_max * scale_y)
+            x_min, x_max = round(s.x_min * scale_x), round(s.x_max * scale_x)
+            current_image[y_min:y_max, x_min:x_max] = original_image[y_min:y_max, x_min:x_max]
 
-        # reduce the image dims and the frame
-        frame = np2pil(current_image)
-        frame.thumbnail(gif_dims)
-        sequence.append(frame.quantize(method=GIF_QUANTIZATION_METHOD).convert("P"))
+        frames.append(current_image.copy())
         i += n
 
+    # quantize the independent frames in parallel (the palette mapping runs in PIL's C code)
+    with ThreadPoolExecutor() as executor:
+        quantized_frames = list(executor.map(lambda frame: _quantize_frame(frame, palette_image), frames))
+    sequence = [quantized_frames[0]] * n_frames_current_image + quantized_frames[1:]
+
     # render the gif from the sequence of frames
     img_byte_arr = io.BytesIO()
     sequence[0].save(img_byte_arr, format="GIF", save_all=True, append_images=sequence[1:], duration=500, loop=0)
     img_byte_arr.seek(0)
 
     return RawImage(mosaic_id=mosaic_id, category=RAW_IMAGE_FILLING_GIF, image_bytes=img_byte_arr.getvalue())
+
+
+def _quantize_frame(pixels: np.ndarray, palette_image: Image.Image) -> Image.Image:
+    # map to the shared palette (no dithering, same as the octree quantization)
+    return np2pil(pixels).quantize(palette=palette_image, dither=Image.NONE)
@@ -1,10 +1,11 @@
 import io
 import math
+from functools import lru_cache
 from typing import Dict, Tuple
 
 import numpy as np
 from cv2 import cv2
-from PIL import Image, ImageEnhance, ImageFilter
+from PIL import Image, ImageEnhance
 from PIL.ImageStat import Stat
 
 from photo_mosaic.models.app_config import get_config
@@ -15,6 +16,7 @@ LOW_BRIGHTNESS = 0
 MEDIUM_BRIGHTNESS = 1
 HIGH_BRIGHTNESS = 2
 GIF_QUANTIZATION_METHOD = Image.FASTOCTREE
+BRIGHTNESS_SAMPLE_SIZE = 512
 
 
 def bytes2pil(byte_arr: bytes) -> Image:
@@ -22,49 +24,159 @@ def bytes2pil(byte_arr: bytes) -> Image:
 
 
 def pil2bytes(image: Image) -> bytes:
+    # PIL's encoder (libjpeg-turbo) is noticeably faster than cv2.imencode for the same output
     img_byte_arr = io.BytesIO()
     image.save(img_byte_arr, format="JPEG")
     return img_byte_arr.getvalue()
 
 
+def np2bytes(array: np.ndarray) -> bytes:
+    """
+    Encode an RGB (or grayscale) pixel array as jpeg
+    """
+    return pil2bytes(np2pil(array))
+
+
+def np_thumbnail(array: np.ndarray, max_size: int) -> np.ndarray:
+    """
+    Downscale a pixel array (keeping its aspect ratio) so that it fits into max_size x max_size
+    """
+    height, width = array.shape[:2]
+    scale = min(max_size / width, max_size / height)
+    if scale >= 1:
+        return array
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(array, size, interpolation=cv2.INTER_AREA)
+
+
 def np2pil(array: np.ndarray) -> Image:
     return Image.fromarray(array)
 
 
 def pil2np(image: Image) -> np.ndarray:
-    return np.array(image)
+    # no extra copy of PIL's buffer (the array is read-only)
+    return np.asarray(image)
 
 
 def adapt_brightness(image: Image, brightness: float) -> Image:
+    if brightness == 1.0:
+        return image
+    if image.mode in ("RGB", "L"):
+        # same as ImageEnhance.Brightness (a float32 blend with black) but as a single lookup table pass
+        return image.point(_get_brightness_lut(brightness).tolist() * len(image.mode))
     enhancer = ImageEnhance.Brightness(image)
     return enhancer.enhance(brightness)
 
 
+def adapt_brightness_np(pixels: np.ndarray, brightness: float) -> np.ndarray:
+    """
+    Same as adapt_brightness() for an uint8 pixel array (e.g. just the part of an image that is actually needed)
+    """
+    if brightness == 1.0:
+        return pixels
+    return cv2.LUT(pixels, _get_brightness_lut(brightness))
+
+
+def _get_brightness_lut(brightness: float) -> np.ndarray:
+    return np.clip(np.arange(256, dtype=np.float32) * np.float32(brightness), 0, 255).astype(np.uint8)
+
+
 def get_brightness_category(image: Image.Image) -> int:
-    avg_brightness = get_average_brightness(image)
-    if get_config().high_brightness_min < avg_brightness <= get_config().high_brightness_max:
+    return _get_brightness_category(get_average_brightness(image))
+
+
+@lru_cache(maxsize=1)
+def _get_brightness_bounds() -> Tuple[int, int, int, int, int, int]:
+    config = get_config()
+    return (
+        config.high_brightness_min,
+        config.high_brightness_max,
+        config.medium_brightness_min,
+        config.medium_brightness_max,
+        config.low_brightness_min,
+        config.low_brightness_max,
+    )
+
+
+def _get_brightness_category(avg_brightness: float) -> int:
+    high_min, high_max, medium_min, medium_max, low_min, low_max = _get_brightness_bounds()
+    if high_min < avg_brightness <= high_max:
         return HIGH_BRIGHTNESS
-    if get_config().medium_brightness_min < avg_brightness <= get_config().medium_brightness_max:
+    if medium_min < avg_brightness <= medium_max:
         return MEDIUM_BRIGHTNESS
-    if get_config().low_brightness_min <= avg_brightness <= get_config().low_brightness_max:
+    if low_min <= avg_brightness <= low_max:
         return LOW_BRIGHTNESS
     return INVALID_BRIGHTNESS
 
 
+def get_segment_brightness_categories(pixels: np.ndarray, metadata: MosaicMetadata) -> np.ndarray:
+    """
+    Determine the brightness categories of all segments of a mosaic at once (one grayscale conversion of the
+    segment grid and a single reduction instead of one conversion/mean per segment)
+    Args:
+        pixels: The original image pixels
+        metadata: The mosaic metadata
+
+    Returns: The brightness categories as an array of shape (n_rows, n_cols)
+
+    """
+    grid = pixels[
+        metadata.space_top : metadata.space_top + metadata.n_rows * metadata.segment_height,
+        metadata.space_left : metadata.space_left + metadata.n_cols * metadata.segment_width,
+    ]
+    if grid.ndim == 3:
+        grid = cv2.cvtColor(
+            np.ascontiguousarray(grid), cv2.COLOR_RGBA2GRAY if grid.shape[2] == 4 else cv2.COLOR_RGB2GRAY
+        )
+    avg_brightness = grid.reshape(
+        metadata.n_rows, metadata.segment_height, metadata.n_cols, metadata.segment_width
+    ).mean(axis=(1, 3))
+    high_min, high_max, medium_min, medium_max, low_min, low_max = _get_brightness_bounds()
+    return np.select(
+        [
+            (high_min < avg_brightness) & (avg_brightness <= high_max),
+            (medium_min < avg_brightness) & (avg_brightness <= medium_max),
+            (low_min <= avg_brightness) & (avg_brightness <= low_max),
+        ],
+        [HIGH_BRIGHTNESS, MEDIUM_BRIGHTNESS, LOW_BRIGHTNESS],
+        INVALID_BRIGHTNESS,
+    )
+
+
 def get_average_brightness(img: Image.Image) -> float:
+    scale = BRIGHTNESS_SAMPLE_SIZE / max(img.size)
+    if scale < 1:
+        # the mean of a regular pixel sample is close enough for the brightness categories (and much cheaper than
+        # converting a full size upload)
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.NEAREST)
+    if img.mode in ("RGB", "RGBA", "L"):
+        return get_average_brightness_np(np.asarray(img))
     temp_img = img.convert("L")
     stat = Stat(temp_img)
     return stat.mean[0]
 
 
+def get_average_brightness_np(pixels: np.ndarray) -> float:
+    """
+    Calculate the average brightness directly on a pixel array (without converting it to a PIL image)
+    Args:
+        pixels: The pixel array (grayscale or RGB(A))
+
+    Returns: The average brightness (ITU-R 601-2 luma, same as PIL's "L" conversion)
+
+    """
+    if pixels.ndim == 3:
+        pixels = cv2.cvtColor(pixels, cv2.COLOR_RGBA2GRAY if pixels.shape[2] == 4 else cv2.COLOR_RGB2GRAY)
+    return cv2.mean(pixels)[0]
+
+
 def center_crop(image: Image, ratio: Tuple[int, int]) -> Image:
     width, height = image.size
     new_width = int(ratio[0] * height / ratio[1])
     left = (width - new_width) / 2
-    top = (height - height) / 2
     right = (width + new_width) / 2
-    bottom = (height + height) / 2
-    return image.crop((left, top, right, bottom))
+    # only the width is cropped (the full height is kept)
+    return image.crop((left, 0, right, height))
 
 
 def get_image_center(metadata: MosaicMetadata) -> Tuple[int, int, int, int]:
@@ -76,8 +188,8 @@ def get_image_center(metadata: MosaicMetadata) -> Tuple[int, int, int, int]:
     Returns: row_min, col_min, row_max, col_max
 
     """
-    m_row = int(metadata.n_rows / 4)
-    m_col = int(metadata.n_cols / 4)
+    m_row = metadata.n_rows // 4
+    m_col = metadata.n_cols // 4
     return m_row, m_col, m_row * 3, m_col * 3
 
 
@@ -95,48 +207,64 @@ def get_segment_config(width: int, height: int, target_num_segments: int, ratio:
 
     Returns: The best found segment config as a dict
 
+    """
+    candidates = get_segment_candidates(width, height, target_num_segments, ratio)
+    if not candidates:
+        return {}
+
+    # best config (the first one with the minimal score)
+    best = int(np.argmin(candidates["score"]))
+    return {key: int(values[best]) for key, values in candidates.items()}
+
+
+def get_segment_candidates(
+    width: int, height: int, target_num_segments: int, ratio: Tuple[int, int]
+) -> Dict[str, np.ndarray]:
+    """
+    Evaluate all segment configs considered by get_segment_config() at once
+    Args:
+        width: The mosaic width
+        height: The mosaic height
+        target_num_segments: The desired number of segments in the mosaic
+        ratio: The width/heigth ratio of a segment
+
+    Returns: One array per config value (seg_h, seg_w, num_rows, num_cols, num_seg, unfilled_pixel_area, score),
+    ordered by increasing segment size (empty dict if there is no candidate)
+
     """
     # find smallest ratio using gcd
     gcd = math.gcd(ratio[0], ratio[1])
-    smallest_ratio = (ratio[0] / gcd, ratio[1] / gcd)
-
-    # find best config (seh_w, seg_h) that minimizes the score
-    # (close to the target_num_segments and minimal unfilled pixel area)
-    current_num_seg = int(width * height)
-    best_config: Dict[str, int] = {}
-    i = 1
-    while current_num_seg > target_num_segments / 4:
-        # calculate next seg_w, seg_h to try
-        seg_w = smallest_ratio[0] * i
-        seg_h = smallest_ratio[1] * i
-
-        # calculate rows, cols, unfilled area, score
-        unfilled_pixels_w = width % seg_w
-        num_cols = (width - unfilled_pixels_w) / seg_w
-        unfilled_pixels_h = height % seg_h
-        num_rows = (height - unfilled_pixels_h) / seg_h
-        unfilled_pixel_area = unfilled_pixels_w * unfilled_pixels_h
-        current_num_seg = int(num_cols * num_rows)
-        current_config = {
-            "seg_h": int(seg_h),
-            "seg_w": int(seg_w),
-            "num_rows": int(num_rows),
-            "num_cols": int(num_cols),
-            "num_seg": int(current_num_seg),
-            "unfilled_pixel_area": int(unfilled_pixel_area),
-            "score": int(
-                abs(current_num_seg - target_num_segments)
-                + get_config().unused_pixel_area_weight * unfilled_pixel_area / (width * height)
-            ),
-        }
-        # check if score is better than best config
-        if len(best_config) > 0:
-            if current_config["score"] < best_config["score"]:
-                best_config = current_config
-        else:
-            best_config = current_config
-        i += 1
-    return best_config
+    smallest_ratio = (ratio[0] // gcd, ratio[1] // gcd)
+
+    # evaluate all candidate configs (seg_w, seg_h) = i * smallest_ratio at once, the number of segments is
+    # non-increasing in i and the search stops at the first config with at most target_num_segments / 4 segments
+    # (which is included)
+    if width * height <= target_num_segments / 4:
+        return {}
+    i = np.arange(1, min(width // smallest_ratio[0], height // smallest_ratio[1]) + 2, dtype=np.int64)
+    seg_w = smallest_ratio[0] * i
+    seg_h = smallest_ratio[1] * i
+
+    # calculate rows, cols, unfilled area, score
+    num_cols, unfilled_pixels_w = np.divmod(width, seg_w)
+    num_rows, unfilled_pixels_h = np.divmod(height, seg_h)
+    unfilled_pixel_area = unfilled_pixels_w * unfilled_pixels_h
+    num_seg = num_cols * num_rows
+    score = np.trunc(
+        np.abs(num_seg - target_num_segments)
+        + get_config().unused_pixel_area_weight * unfilled_pixel_area / (width * height)
+    )
+
+    n = int(np.argmax(num_seg <= target_num_segments / 4)) + 1
+    return {
+        "seg_h": seg_h[:n],
+        "seg_w": seg_w[:n],
+        "num_rows": num_rows[:n],
+        "num_cols": num_cols[:n],
+        "num_seg": num_seg[:n],
+        "unfilled_pixel_area": unfilled_pixel_area[:n],
+        "score": score[:n],
+    }
 
 
 def apply_filter(
@@ -156,12 +284,34 @@ def apply_filter(
     Returns: The stylized image
 
     """
-    processed_portrait = portrait_image
-    processed_filter = filter_image
+    return np2pil(apply_filter_np(np.asarray(portrait_image), np.asarray(filter_image), blend_value, blur_radius))
+
+
+def apply_filter_np(
+    portrait_pixels: np.ndarray,
+    filter_pixels: np.ndarray,
+    blend_value: float,
+    blur_radius: float = None,
+) -> np.ndarray:
+    """
+    Same as apply_filter() for pixel arrays of the same shape (uint8)
+    """
     if blur_radius:
-        processed_filter = processed_filter.filter(ImageFilter.BoxBlur(blur_radius))
-    return np2pil(
-        cv2.addWeighted(pil2np(processed_portrait), blend_value, pil2np(processed_filter), 1 - blend_value, 0).astype(
-            np.uint8
-        )
-    )
+        # the blurred copy is not shared with the caller, so blend into it instead of allocating another buffer
+        filter_pixels = result = box_blur(filter_pixels, blur_radius)
+    else:
+        result = np.empty_like(portrait_pixels)
+    cv2.addWeighted(portrait_pixels, blend_value, filter_pixels, 1 - blend_value, 0, dst=result)
+    return result
+
+
+def box_blur(pixels: np.ndarray, radius: float) -> np.ndarray:
+    """
+    Box blur of a pixel array, equivalent to PIL's ImageFilter.BoxBlur (including fractional radii and edge
+    extension) but done by a separable opencv filter
+    """
+    n = int(math.floor(radius))
+    kernel = np.ones(2 * n + 3, dtype=np.float32)
+    kernel[0] = kernel[-1] = radius - n  # weight of the partially covered outer pixels
+    kernel /= 2 * radius + 1
+    return cv2.sepFilter2D(pixels, -1, kernel, kernel, borderType=cv2.BORDER_REPLICATE)
@@ -1,9 +1,13 @@
+import re
 import uuid
 
 from fastapi import HTTPException
 
 from photo_mosaic.services.persistence import db
 
+# canonical (hyphenated) uuid string, the format of all ids generated by generate_id()
+UUID_PATTERN = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+
 
 def validate_request_uuid(uuid_string: str, id_label: str) -> str:
     stripped_uuid = str(uuid_string).strip()
@@ -18,11 +22,7 @@ def validate_request_uuid(uuid_string: str, id_label: str) -> str:
 
 
 def uuid_format_is_valid(uuid_string: str) -> bool:
-    try:
-        uuid.UUID(uuid_string)
-        return True
-    except ValueError:
-        return False
+    return UUID_PATTERN.fullmatch(uuid_string) is not None
 
 
 def uuid_exists(uuid_string: str, id_label: str) -> bool:
@@ -1,7 +1,9 @@
 import os
 import pathlib
+from functools import lru_cache
 
 
+@lru_cache(maxsize=1)
 def version() -> str:
     current_file = pathlib.Path(__file__)
     version_file = os.path.join(current_file.parent.parent.parent, "VERSION")
@@ -0,0 +1,48 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+import tensorflow as tf
+import tensorflow_hub as hub
+from PIL import Image
+
+IMAGE_DIMS = (224, 224)
+NUM_CALIBRATION_IMAGES = 200
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model", help="Path to the saved keras NSFW model", type=str, required=True)
+    parser.add_argument(
+        "-i", "--images", help="Directory with representative images for the calibration", type=str, required=True
+    )
+    parser.add_argument("-o", "--output", help="Path of the resulting .tflite file", type=str, required=True)
+    args = parser.parse_args(args)
+    print("Converting NSFW model to INT8 tflite model...")
+    tflite_model = quantize_model(args.model, args.images)
+    with open(args.output, "wb") as f_h:
+        f_h.write(tflite_model)
+    print(f"\nNSFW_MODEL_PATH={args.output}\n")
+
+
+def quantize_model(model_path: str, image_dir: str) -> bytes:
+    model = tf.keras.models.load_model(model_path, custom_objects={"KerasLayer": hub.KerasLayer})
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset(image_dir)
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
+
+
+def representative_dataset(image_dir: str):
+    def generator():
+        for file_name in sorted(os.listdir(image_dir))[:NUM_CALIBRATION_IMAGES]:
+            image = Image.open(os.path.join(image_dir, file_name)).convert("RGB").resize(IMAGE_DIMS, Image.BILINEAR)
+            yield [np.asarray(image, dtype=np.float32)[np.newaxis] / 255.0]
+
+    return generator
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
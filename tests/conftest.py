@@ -0,0 +1,16 @@
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="session")
+def client(tmp_path_factory):
+    # the app (and its persistence service) is created once per process with the config of the first import, so
+    # all test modules share one client/db, the modules clean up the mosaics they create
+    os.environ["SQLITE_PATH"] = str(tmp_path_factory.mktemp("db"))
+    os.environ["SQLITE_SYNCHRONOUS"] = "OFF"  # throwaway db, no need to wait for the disk
+
+    from photo_mosaic.app import app
+
+    return TestClient(app)
@@ -1,8 +1,5 @@
-import os
-
 import numpy as np
 import pytest
-from fastapi.testclient import TestClient
 
 from photo_mosaic.models.image_pixels import (
     IMAGE_PIXELS_CATEGORY_CURRENT,
@@ -33,31 +30,39 @@ config = MosaicConfig(
     segment_blur_high=1,
 )
 
-image_0 = np.ones((SEGMENT_HEIGHT * N_ROWS, SEGMENT_WIDTH * N_COLS, 3), dtype="uint8") * 127
-image_0_reduced_brightness = np.ones((SEGMENT_HEIGHT * N_ROWS, SEGMENT_WIDTH * N_COLS, 3), dtype="uint8") * 25
-image_0_small_orig = np.ones((512, 384, 3), dtype="uint8") * 127
-image_0_small_reduced_brightness = np.ones((512, 384, 3), dtype="uint8") * 25
+image_0 = np.full((SEGMENT_HEIGHT * N_ROWS, SEGMENT_WIDTH * N_COLS, 3), 127, dtype="uint8")
+image_0_reduced_brightness = np.full((SEGMENT_HEIGHT * N_ROWS, SEGMENT_WIDTH * N_COLS, 3), 25, dtype="uint8")
+image_0_small_orig = np.full((512, 384, 3), 127, dtype="uint8")
+image_0_small_reduced_brightness = np.full((512, 384, 3), 25, dtype="uint8")
 
+# encoded once (instead of once per request)
+image_0_bytes = pil2bytes(np2pil(image_0))
 
-@pytest.fixture(scope="function")
-def prepare_db(request, tmp_path):
-    db_path = tmp_path / "db"
-    db_path.mkdir()
-    os.environ["SQLITE_PATH"] = str(db_path)
 
-    from photo_mosaic.app import app
+@pytest.fixture(scope="module")
+def prepare_db(request, client):
+    # the db is emptied after each test (see clean_db)
     from photo_mosaic.services.persistence import db
 
-    client = TestClient(app)
-
     def teardown_db():
         db.disconnect()
+
+    request.addfinalizer(teardown_db)
+    return client, db
+
+
+@pytest.fixture(autouse=True)
+def clean_db(request, prepare_db):
+    # pylint: disable=redefined-outer-name
+    _, db = prepare_db
+
+    def delete_mosaics():
         mosaics = db.read_mosaic_list()
         for m in mosaics:
             db.delete_mosaic_metadata(m[0])
+        db.commit()
 
-    request.addfinalizer(teardown_db)
-    return client, db
+    request.addfinalizer(delete_mosaics)
 
 
 def test_create_mosaic(prepare_db):
@@ -65,7 +70,7 @@ def test_create_mosaic(prepare_db):
     client, db = prepare_db
     response = client.post(
         "/mosaic/",
-        files={"file": ("filename", pil2bytes(np2pil(image_0)), "image/jpeg")},
+        files={"file": ("filename", image_0_bytes, "image/jpeg")},
         data={
             "title": config.title,
             "num_segments": config.num_segments,
@@ -132,7 +137,7 @@ def test_delete_mosaic(prepare_db):
     client, db = prepare_db
     response = client.post(
         "/mosaic/",
-        files={"file": ("filename", pil2bytes(np2pil(image_0)), "image/jpeg")},
+        files={"file": ("filename", image_0_bytes, "image/jpeg")},
         data={
             "title": config.title,
             "num_segments": config.num_segments,
@@ -157,7 +162,7 @@ def test_reset_mosaic(prepare_db):
     client, db = prepare_db
     response = client.post(
         "/mosaic/",
-        files={"file": ("filename", pil2bytes(np2pil(image_0)), "image/jpeg")},
+        files={"file": ("filename", image_0_bytes, "image/jpeg")},
         data={
             "title": config.title,
             "num_segments": config.num_segments,
@@ -173,7 +178,7 @@ def test_reset_mosaic(prepare_db):
     mosaic_id = response.headers["mosaic_id"]
     response = client.post(
         f"/mosaic/{mosaic_id}/segment",
-        files={"file": ("filename", pil2bytes(np2pil(image_0)), "image/jpeg")},
+        files={"file": ("filename", image_0_bytes, "image/jpeg")},
         data={"quick_fill": "false"},
     )
     assert response.status_code == 200
@@ -233,7 +238,7 @@ def test_create_mosaic_invalid_param(prepare_db):
     client, _ = prepare_db
     response = client.post(
         "/mosaic/",
-        files={"file": ("filename", pil2bytes(np2pil(image_0)), "image/jpeg")},
+        files={"file": ("filename", image_0_bytes, "image/jpeg")},
         data={
             "title": config.title,
             "num_segments": config.num_segments,
@@ -253,7 +258,7 @@ def test_update_mosaic_state(prepare_db):
     client, db = prepare_db
     response = client.post(
         "/mosaic/",
-        files={"file": ("filename", pil2bytes(np2pil(image_0)), "image/jpeg")},
+        files={"file": ("filename", image_0_bytes, "image/jpeg")},
         data={
             "title": config.title,
             "num_segments": config.num_segments,
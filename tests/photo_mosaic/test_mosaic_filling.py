@@ -1,8 +1,5 @@
-import os
-
 import numpy as np
 import pytest
-from fastapi.testclient import TestClient
 
 from photo_mosaic.models.image_pixels import IMAGE_PIXELS_CATEGORY_CURRENT
 from photo_mosaic.models.mosaic_config import MosaicConfig
@@ -26,42 +23,50 @@ config = MosaicConfig(
 )
 
 # image with three vertical stripes of different brightness
-image_0 = np.hstack(
-    [
-        np.ones((SEGMENT_HEIGHT * N_ROWS, SEGMENT_WIDTH, 3), dtype="uint8") * 50,
-        np.ones((SEGMENT_HEIGHT * N_ROWS, SEGMENT_WIDTH, 3), dtype="uint8") * 100,
-        np.ones((SEGMENT_HEIGHT * N_ROWS, SEGMENT_WIDTH, 3), dtype="uint8") * 150,
-    ]
-)
+image_0 = np.empty((SEGMENT_HEIGHT * N_ROWS, 3 * SEGMENT_WIDTH, 3), dtype="uint8")
+image_0[:, :SEGMENT_WIDTH] = 50
+image_0[:, SEGMENT_WIDTH : 2 * SEGMENT_WIDTH] = 100
+image_0[:, 2 * SEGMENT_WIDTH :] = 150
 
-dark_portrait = np.ones((SEGMENT_HEIGHT, SEGMENT_WIDTH, 3), dtype="uint8") * 35
-medium_portrait = np.ones((SEGMENT_HEIGHT, SEGMENT_WIDTH, 3), dtype="uint8") * 85
-bright_portrait = np.ones((SEGMENT_HEIGHT, SEGMENT_WIDTH, 3), dtype="uint8") * 200
+dark_portrait = np.full((SEGMENT_HEIGHT, SEGMENT_WIDTH, 3), 35, dtype="uint8")
+medium_portrait = np.full((SEGMENT_HEIGHT, SEGMENT_WIDTH, 3), 85, dtype="uint8")
+bright_portrait = np.full((SEGMENT_HEIGHT, SEGMENT_WIDTH, 3), 200, dtype="uint8")
 
-image_0_reduced_brightness = np.ones((SEGMENT_HEIGHT * N_ROWS, SEGMENT_WIDTH * N_COLS, 3), dtype="uint8") * 25
-image_0_small_orig = np.ones((512, 384, 3), dtype="uint8") * 127
-image_0_small_reduced_brightness = np.ones((512, 384, 3), dtype="uint8") * 25
+# encoded once (instead of once per request)
+image_0_bytes = pil2bytes(np2pil(image_0))
+dark_portrait_bytes = pil2bytes(np2pil(dark_portrait))
+medium_portrait_bytes = pil2bytes(np2pil(medium_portrait))
+bright_portrait_bytes = pil2bytes(np2pil(bright_portrait))
 
+image_0_reduced_brightness = np.full((SEGMENT_HEIGHT * N_ROWS, SEGMENT_WIDTH * N_COLS, 3), 25, dtype="uint8")
+image_0_small_orig = np.full((512, 384, 3), 127, dtype="uint8")
+image_0_small_reduced_brightness = np.full((512, 384, 3), 25, dtype="uint8")
 
-@pytest.fixture(scope="function")
-def prepare_db(request, tmp_path):
-    db_path = tmp_path / "db"
-    db_path.mkdir()
-    os.environ["SQLITE_PATH"] = str(db_path)
 
-    from photo_mosaic.app import app
+@pytest.fixture(scope="module")
+def prepare_db(request, client):
+    # the db is emptied after each test (see clean_db)
     from photo_mosaic.services.persistence import db
 
-    client = TestClient(app)
-
     def teardown_db():
         db.disconnect()
+
+    request.addfinalizer(teardown_db)
+    return client, db
+
+
+@pytest.fixture(autouse=True)
+def clean_db(request, prepare_db):
+    # pylint: disable=redefined-outer-name
+    _, db = prepare_db
+
+    def delete_mosaics():
         mosaics = db.read_mosaic_list()
         for m in mosaics:
             db.delete_mosaic_metadata(m[0])
+        db.commit()
 
-    request.addfinalizer(teardown_db)
-    return client, db
+    request.addfinalizer(delete_mosaics)
 
 
 def test_segment_brightness_detection(prepare_db):
@@ -69,7 +74,7 @@ def test_segment_brightness_detection(prepare_db):
     client, db = prepare_db
     response = client.post(
         "/mosaic/",
-        files={"file": ("filename", pil2bytes(np2pil(image_0)), "image/jpeg")},
+        files={"file": ("filename", image_0_bytes, "image/jpeg")},
         data={
             "title": config.title,
             "num_segments": config.num_segments,
@@ -97,7 +102,7 @@ def test_segment_sampling(prepare_db):
     client, _ = prepare_db
     response = client.post(
         "/mosaic/",
-        files={"file": ("filename", pil2bytes(np2pil(image_0)), "image/jpeg")},
+        files={"file": ("filename", image_0_bytes, "image/jpeg")},
         data={
             "title": config.title,
             "num_segments": config.num_segments,
@@ -115,7 +120,7 @@ def test_segment_sampling(prepare_db):
     # test dark sampling
     response = client.post(
         f"/mosaic/{mosaic_id}/segment/sample/0",
-        files={"file": ("filename", pil2bytes(np2pil(dark_portrait)), "image/jpeg")},
+        files={"file": ("filename", dark_portrait_bytes, "image/jpeg")},
     )
     assert response.status_code == 200
     img = pil2np(bytes2pil(response.content))
@@ -125,7 +130,7 @@ def test_segment_sampling(prepare_db):
     # test medium sampling
     response = client.post(
         f"/mosaic/{mosaic_id}/segment/sample/5",
-        files={"file": ("filename", pil2bytes(np2pil(medium_portrait)), "image/jpeg")},
+        files={"file": ("filename", medium_portrait_bytes, "image/jpeg")},
     )
     assert response.status_code == 200
     img = pil2np(bytes2pil(response.content))
@@ -135,7 +140,7 @@ def test_segment_sampling(prepare_db):
     # test bright sampling
     response = client.post(
         f"/mosaic/{mosaic_id}/segment/sample/25",
-        files={"file": ("filename", pil2bytes(np2pil(bright_portrait)), "image/jpeg")},
+        files={"file": ("filename", bright_portrait_bytes, "image/jpeg")},
     )
     assert response.status_code == 200
     img = pil2np(bytes2pil(response.content))
@@ -148,7 +153,7 @@ def test_segment_filling(prepare_db):
     client, db = prepare_db
     response = client.post(
         "/mosaic/",
-        files={"file": ("filename", pil2bytes(np2pil(image_0)), "image/jpeg")},
+        files={"file": ("filename", image_0_bytes, "image/jpeg")},
         data={
             "title": config.title,
             "num_segments": config.num_segments,
@@ -165,14 +170,14 @@ def test_segment_filling(prepare_db):
 
     response = client.post(
         f"/mosaic/{mosaic_id}/segment/sample/0",
-        files={"file": ("filename", pil2bytes(np2pil(bright_portrait)), "image/jpeg")},
+        files={"file": ("filename", bright_portrait_bytes, "image/jpeg")},
     )
     assert response.status_code == 200
     segment_id = response.headers["segment_id"]
 
     response = client.post(
         f"/mosaic/{mosaic_id}/segment/{segment_id}",
-        files={"file": ("filename", pil2bytes(np2pil(bright_portrait)), "image/jpeg")},
+        files={"file": ("filename", bright_portrait_bytes, "image/jpeg")},
     )
     assert response.status_code == 200
 
@@ -189,116 +194,21 @@ def test_segment_filling(prepare_db):
     assert np.amin(seg_pixels) >= 158 and np.amax(seg_pixels) <= 162  # jpeg compression tolerance
 
 
-def test_segment_filling_order_dark(prepare_db):
-    # pylint: disable=redefined-outer-name
-    client, db = prepare_db
-    response = client.post(
-        "/mosaic/",
-        files={"file": ("filename", pil2bytes(np2pil(image_0)), "image/jpeg")},
-        data={
-            "title": config.title,
-            "num_segments": config.num_segments,
-            "mosaic_bg_brightness": config.mosaic_bg_brightness,
-            "mosaic_blend_value": config.mosaic_blend_value,
-            "segment_blend_value": config.segment_blend_value,
-            "segment_blur_low": config.segment_blur_low,
-            "segment_blur_medium": config.segment_blur_medium,
-            "segment_blur_high": config.segment_blur_high,
-        },
-    )
-    assert response.status_code == 200
-    mosaic_id = response.headers["mosaic_id"]
-
-    response = client.post(
-        f"/mosaic/{mosaic_id}/segment", files={"file": ("filename", pil2bytes(np2pil(dark_portrait)), "image/jpeg")}
-    )
-    assert response.status_code == 200
-    response = client.post(
-        f"/mosaic/{mosaic_id}/segment", files={"file": ("filename", pil2bytes(np2pil(dark_portrait)), "image/jpeg")}
-    )
-    assert response.status_code == 200
-    stats = db.get_segment_stats(mosaic_id)
-    expected_stats = {0: 0, 1: 10, 2: 10}
-    assert stats == expected_stats
-    response = client.post(
-        f"/mosaic/{mosaic_id}/segment", files={"file": ("filename", pil2bytes(np2pil(dark_portrait)), "image/jpeg")}
-    )
-    assert response.status_code == 200
-    response = client.post(
-        f"/mosaic/{mosaic_id}/segment", files={"file": ("filename", pil2bytes(np2pil(dark_portrait)), "image/jpeg")}
-    )
-    assert response.status_code == 200
-    stats = db.get_segment_stats(mosaic_id)
-    expected_stats = {0: 0, 1: 0, 2: 10}
-    assert stats == expected_stats
-    response = client.post(
-        f"/mosaic/{mosaic_id}/segment", files={"file": ("filename", pil2bytes(np2pil(dark_portrait)), "image/jpeg")}
-    )
-    assert response.status_code == 200
-
-    stats = db.get_segment_stats(mosaic_id)
-    expected_stats = {0: 0, 1: 0, 2: 5}
-    assert stats == expected_stats
-
-
-def test_segment_filling_order_medium(prepare_db):
-    # pylint: disable=redefined-outer-name
-    client, db = prepare_db
-    response = client.post(
-        "/mosaic/",
-        files={"file": ("filename", pil2bytes(np2pil(image_0)), "image/jpeg")},
-        data={
-            "title": config.title,
-            "num_segments": config.num_segments,
-            "mosaic_bg_brightness": config.mosaic_bg_brightness,
-            "mosaic_blend_value": config.mosaic_blend_value,
-            "segment_blend_value": config.segment_blend_value,
-            "segment_blur_low": config.segment_blur_low,
-            "segment_blur_medium": config.segment_blur_medium,
-            "segment_blur_high": config.segment_blur_high,
-        },
-    )
-    assert response.status_code == 200
-    mosaic_id = response.headers["mosaic_id"]
-
-    response = client.post(
-        f"/mosaic/{mosaic_id}/segment", files={"file": ("filename", pil2bytes(np2pil(medium_portrait)), "image/jpeg")}
-    )
-    assert response.status_code == 200
-    response = client.post(
-        f"/mosaic/{mosaic_id}/segment", files={"file": ("filename", pil2bytes(np2pil(medium_portrait)), "image/jpeg")}
-    )
-    assert response.status_code == 200
-    stats = db.get_segment_stats(mosaic_id)
-    expected_stats = {0: 10, 1: 0, 2: 10}
-    assert stats == expected_stats
-    response = client.post(
-        f"/mosaic/{mosaic_id}/segment", files={"file": ("filename", pil2bytes(np2pil(medium_portrait)), "image/jpeg")}
-    )
-    assert response.status_code == 200
-    response = client.post(
-        f"/mosaic/{mosaic_id}/segment", files={"file": ("filename", pil2bytes(np2pil(medium_portrait)), "image/jpeg")}
-    )
-    assert response.status_code == 200
-    stats = db.get_segment_stats(mosaic_id)
-    expected_stats = {0: 0, 1: 0, 2: 10}
-    assert stats == expected_stats
-    response = client.post(
-        f"/mosaic/{mosaic_id}/segment", files={"file": ("filename", pil2bytes(np2pil(medium_portrait)), "image/jpeg")}
-    )
-    assert response.status_code == 200
-
-    stats = db.get_segment_stats(mosaic_id)
-    expected_stats = {0: 0, 1: 0, 2: 5}
-    assert stats == expected_stats
-
-
-def test_segment_filling_order_bright(prepare_db):
+@pytest.mark.parametrize(
+    "portrait_bytes, expected_stats_2, expected_stats_4, expected_stats_5",
+    [
+        (dark_portrait_bytes, {0: 0, 1: 10, 2: 10}, {0: 0, 1: 0, 2: 10}, {0: 0, 1: 0, 2: 5}),
+        (medium_portrait_bytes, {0: 10, 1: 0, 2: 10}, {0: 0, 1: 0, 2: 10}, {0: 0, 1: 0, 2: 5}),
+        (bright_portrait_bytes, {0: 10, 1: 10, 2: 0}, {0: 10, 1: 0, 2: 0}, {0: 5, 1: 0, 2: 0}),
+    ],
+    ids=["dark", "medium", "bright"],
+)
+def test_segment_filling_order(prepare_db, portrait_bytes, expected_stats_2, expected_stats_4, expected_stats_5):
     # pylint: disable=redefined-outer-name
     client, db = prepare_db
     response = client.post(
         "/mosaic/",
-        files={"file": ("filename", pil2bytes(np2pil(image_0)), "image/jpeg")},
+        files={"file": ("filename", image_0_bytes, "image/jpeg")},
         data={
             "title": config.title,
             "num_segments": config.num_segments,
@@ -313,33 +223,14 @@ def test_segment_filling_order_bright(prepare_db):
     assert response.status_code == 200
     mosaic_id = response.headers["mosaic_id"]
 
-    response = client.post(
-        f"/mosaic/{mosaic_id}/segment", files={"file": ("filename", pil2bytes(np2pil(bright_portrait)), "image/jpeg")}
-    )
-    assert response.status_code == 200
-    response = client.post(
-        f"/mosaic/{mosaic_id}/segment", files={"file": ("filename", pil2bytes(np2pil(bright_portrait)), "image/jpeg")}
-    )
-    assert response.status_code == 200
-    stats = db.get_segment_stats(mosaic_id)
-    expected_stats = {0: 10, 1: 10, 2: 0}
-    assert stats == expected_stats
-    response = client.post(
-        f"/mosaic/{mosaic_id}/segment", files={"file": ("filename", pil2bytes(np2pil(bright_portrait)), "image/jpeg")}
-    )
-    assert response.status_code == 200
-    response = client.post(
-        f"/mosaic/{mosaic_id}/segment", files={"file": ("filename", pil2bytes(np2pil(bright_portrait)), "image/jpeg")}
-    )
-    assert response.status_code == 200
-    stats = db.get_segment_stats(mosaic_id)
-    expected_stats = {0: 10, 1: 0, 2: 0}
-    assert stats == expected_stats
-    response = client.post(
-        f"/mosaic/{mosaic_id}/segment", files={"file": ("filename", pil2bytes(np2pil(bright_portrait)), "image/jpeg")}
-    )
-    assert response.status_code == 200
-
-    stats = db.get_segment_stats(mosaic_id)
-    expected_stats = {0: 5, 1: 0, 2: 0}
-    assert stats == expected_stats
+    segment_url = f"/mosaic/{mosaic_id}/segment"
+    files = {"file": ("filename", portrait_bytes, "image/jpeg")}
+    for n_filled in range(1, 6):
+        response = client.post(segment_url, files=files)
+        assert response.status_code == 200
+        if n_filled == 2:
+            assert db.get_segment_stats(mosaic_id) == expected_stats_2
+        elif n_filled == 4:
+            assert db.get_segment_stats(mosaic_id) == expected_stats_4
+
+    assert db.get_segment_stats(mosaic_id) == expected_stats_5
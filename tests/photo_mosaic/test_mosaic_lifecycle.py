@@ -1,8 +1,8 @@
-import os
+import io
 
 import numpy as np
 import pytest
-from fastapi.testclient import TestClient
+from PIL import Image
 
 from photo_mosaic.models.mosaic_config import MosaicConfig
 from photo_mosaic.models.raw_image import (
@@ -29,23 +29,25 @@ config = MosaicConfig(
 )
 
 # image with three vertical stripes of different brightness
-image_0 = np.hstack(
-    [
-        np.ones((SEGMENT_HEIGHT * N_ROWS, SEGMENT_WIDTH * 5, 3), dtype="uint8") * 50,
-        np.ones((SEGMENT_HEIGHT * N_ROWS, SEGMENT_WIDTH * 5, 3), dtype="uint8") * 100,
-        np.ones((SEGMENT_HEIGHT * N_ROWS, SEGMENT_WIDTH * 5, 3), dtype="uint8") * 150,
-    ]
-)
+STRIPE_WIDTH = SEGMENT_WIDTH * 5
+image_0 = np.empty((SEGMENT_HEIGHT * N_ROWS, 3 * STRIPE_WIDTH, 3), dtype="uint8")
+image_0[:, :STRIPE_WIDTH] = 50
+image_0[:, STRIPE_WIDTH : 2 * STRIPE_WIDTH] = 100
+image_0[:, 2 * STRIPE_WIDTH :] = 150
+
+dark_portrait = np.full((SEGMENT_HEIGHT, SEGMENT_WIDTH, 3), 35, dtype="uint8")
+medium_portrait = np.full((SEGMENT_HEIGHT, SEGMENT_WIDTH, 3), 85, dtype="uint8")
+bright_portrait = np.full((SEGMENT_HEIGHT, SEGMENT_WIDTH, 3), 200, dtype="uint8")
 
-dark_portrait = np.ones((SEGMENT_HEIGHT, SEGMENT_WIDTH, 3), dtype="uint8") * 35
-medium_portrait = np.ones((SEGMENT_HEIGHT, SEGMENT_WIDTH, 3), dtype="uint8") * 85
-bright_portrait = np.ones((SEGMENT_HEIGHT, SEGMENT_WIDTH, 3), dtype="uint8") * 200
+# encoded once (instead of once per request)
+image_0_bytes = pil2bytes(np2pil(image_0))
+bright_portrait_bytes = pil2bytes(np2pil(bright_portrait))
 
 
-def create_mosaic(client, image, mosaic_config) -> str:
+def create_mosaic(client, image_bytes, mosaic_config) -> str:
     response = client.post(
         "/mosaic/",
-        files={"file": ("filename", pil2bytes(np2pil(image)), "image/jpeg")},
+        files={"file": ("filename", image_bytes, "image/jpeg")},
         data={
             "title": mosaic_config.title,
             "num_segments": mosaic_config.num_segments,
@@ -61,42 +63,47 @@ def create_mosaic(client, image, mosaic_config) -> str:
     return response.headers["mosaic_id"]
 
 
-@pytest.fixture(scope="function")
-def prepare_db(request, tmp_path):
-    db_path = tmp_path / "db"
-    db_path.mkdir()
-    os.environ["SQLITE_PATH"] = str(db_path)
-
-    from photo_mosaic.app import app
+@pytest.fixture(scope="module")
+def prepare_db(request, client):
+    # the db is emptied after each test (see clean_db)
     from photo_mosaic.services.persistence import db
 
-    client = TestClient(app)
-
     def teardown_db():
         db.disconnect()
+
+    request.addfinalizer(teardown_db)
+    return client, db
+
+
+@pytest.fixture(autouse=True)
+def clean_db(request, prepare_db):
+    # pylint: disable=redefined-outer-name
+    _, db = prepare_db
+
+    def delete_mosaics():
         mosaics = db.read_mosaic_list()
         for m in mosaics:
             db.delete_mosaic_metadata(m[0])
+        db.commit()
 
-    request.addfinalizer(teardown_db)
-    return client, db
+    request.addfinalizer(delete_mosaics)
 
 
 def test_mosaic_end(prepare_db):
     # pylint: disable=redefined-outer-name
     client, db = prepare_db
-    mosaic_id = create_mosaic(client, image_0, config)
+    mosaic_id = create_mosaic(client, image_0_bytes, config)
 
     # fill mosaic
     for _ in range(10):
         response = client.post(
             f"/mosaic/{mosaic_id}/segment",
-            files={"file": ("filename", pil2bytes(np2pil(bright_portrait)), "image/jpeg")},
+            files={"file": ("filename", bright_portrait_bytes, "image/jpeg")},
         )
         assert response.status_code == 200
     response = client.post(
         f"/mosaic/{mosaic_id}/segment",
-        files={"file": ("filename", pil2bytes(np2pil(bright_portrait)), "image/jpeg")},
+        files={"file": ("filename", bright_portrait_bytes, "image/jpeg")},
         data={"quick_fill": "false"},
     )
     assert response.status_code == 200
@@ -110,8 +117,9 @@ def test_mosaic_end(prepare_db):
     filled_np = pil2np(bytes2pil(db.read_raw_image(mosaic_id, RAW_IMAGE_CURRENT_SMALL_JPEG).image_bytes))
     assert filled_np.shape == (512, 384, 3)
     assert np.amin(filled_np) >= 42 and np.amax(filled_np) <= 162  # tolerance
-    original = pil2np(bytes2pil(db.read_raw_image(mosaic_id, RAW_IMAGE_ORIGINAL_JPEG).image_bytes))
-    assert original.shape == (512, 384, 3)
+    # only the jpeg header is needed for the size
+    original = Image.open(io.BytesIO(db.read_raw_image(mosaic_id, RAW_IMAGE_ORIGINAL_JPEG).image_bytes))
+    assert (original.height, original.width, len(original.getbands())) == (512, 384, 3)
 
     # check if new mosaic created
     mosaic_list = db.read_mosaic_list()
@@ -134,15 +142,15 @@ def test_mosaic_end(prepare_db):
 def test_mosaic_filled_next_becomes_active(prepare_db):
     # pylint: disable=redefined-outer-name
     client, db = prepare_db
-    mosaic_id_0 = create_mosaic(client, image_0, config)
-    mosaic_id_1 = create_mosaic(client, image_0, config)
-    mosaic_id_2 = create_mosaic(client, image_0, config)
+    mosaic_id_0 = create_mosaic(client, image_0_bytes, config)
+    mosaic_id_1 = create_mosaic(client, image_0_bytes, config)
+    mosaic_id_2 = create_mosaic(client, image_0_bytes, config)
 
     # fill mosaic
     for _ in range(10):
         response = client.post(
             f"/mosaic/{mosaic_id_0}/segment",
-            files={"file": ("filename", pil2bytes(np2pil(bright_portrait)), "image/jpeg")},
+            files={"file": ("filename", bright_portrait_bytes, "image/jpeg")},
         )
         assert response.status_code == 200
 
@@ -162,9 +170,9 @@ def test_mosaic_filled_next_becomes_active(prepare_db):
 def test_mosaic_delete_next_becomes_active(prepare_db):
     # pylint: disable=redefined-outer-name
     client, db = prepare_db
-    mosaic_id_0 = create_mosaic(client, image_0, config)
-    mosaic_id_1 = create_mosaic(client, image_0, config)
-    mosaic_id_2 = create_mosaic(client, image_0, config)
+    mosaic_id_0 = create_mosaic(client, image_0_bytes, config)
+    mosaic_id_1 = create_mosaic(client, image_0_bytes, config)
+    mosaic_id_2 = create_mosaic(client, image_0_bytes, config)
 
     response = client.delete(f"/mosaic/{mosaic_id_0}")
     assert response.status_code == 200
@@ -181,15 +189,15 @@ def test_mosaic_delete_next_becomes_active(prepare_db):
 def test_mosaic_delete_filled(prepare_db):
     # pylint: disable=redefined-outer-name
     client, db = prepare_db
-    mosaic_id_0 = create_mosaic(client, image_0, config)
-    mosaic_id_1 = create_mosaic(client, image_0, config)
-    mosaic_id_2 = create_mosaic(client, image_0, config)
+    mosaic_id_0 = create_mosaic(client, image_0_bytes, config)
+    mosaic_id_1 = create_mosaic(client, image_0_bytes, config)
+    mosaic_id_2 = create_mosaic(client, image_0_bytes, config)
 
     # fill mosaic
     for _ in range(10):
         response = client.post(
             f"/mosaic/{mosaic_id_0}/segment",
-            files={"file": ("filename", pil2bytes(np2pil(bright_portrait)), "image/jpeg")},
+            files={"file": ("filename", bright_portrait_bytes, "image/jpeg")},
         )
         assert response.status_code == 200
     response = client.delete(f"/mosaic/{mosaic_id_0}")
@@ -209,14 +217,14 @@ def test_mosaic_delete_filled(prepare_db):
 def test_mosaic_delete_next(prepare_db):
     # pylint: disable=redefined-outer-name
     client, db = prepare_db
-    mosaic_id_0 = create_mosaic(client, image_0, config)
-    mosaic_id_1 = create_mosaic(client, image_0, config)
+    mosaic_id_0 = create_mosaic(client, image_0_bytes, config)
+    mosaic_id_1 = create_mosaic(client, image_0_bytes, config)
 
     # fill mosaic
     for _ in range(10):
         response = client.post(
             f"/mosaic/{mosaic_id_0}/segment",
-            files={"file": ("filename", pil2bytes(np2pil(bright_portrait)), "image/jpeg")},
+            files={"file": ("filename", bright_portrait_bytes, "image/jpeg")},
         )
         assert response.status_code == 200
 
@@ -232,15 +240,15 @@ def test_mosaic_delete_next(prepare_db):
 def test_mosaic_delete_next_2(prepare_db):
     # pylint: disable=redefined-outer-name
     client, db = prepare_db
-    mosaic_id_0 = create_mosaic(client, image_0, config)
-    mosaic_id_1 = create_mosaic(client, image_0, config)
-    mosaic_id_2 = create_mosaic(client, image_0, config)
+    mosaic_id_0 = create_mosaic(client, image_0_bytes, config)
+    mosaic_id_1 = create_mosaic(client, image_0_bytes, config)
+    mosaic_id_2 = create_mosaic(client, image_0_bytes, config)
 
     # fill mosaic
     for _ in range(10):
         response = client.post(
             f"/mosaic/{mosaic_id_0}/segment",
-            files={"file": ("filename", pil2bytes(np2pil(bright_portrait)), "image/jpeg")},
+            files={"file": ("filename", bright_portrait_bytes, "image/jpeg")},
         )
         assert response.status_code == 200
 
@@ -261,15 +269,15 @@ def test_mosaic_delete_next_2(prepare_db):
 def test_mosaic_delete_next_3(prepare_db):
     # pylint: disable=redefined-outer-name
     client, db = prepare_db
-    mosaic_id_0 = create_mosaic(client, image_0, config)
-    mosaic_id_1 = create_mosaic(client, image_0, config)
-    mosaic_id_2 = create_mosaic(client, image_0, config)
+    mosaic_id_0 = create_mosaic(client, image_0_bytes, config)
+    mosaic_id_1 = create_mosaic(client, image_0_bytes, config)
+    mosaic_id_2 = create_mosaic(client, image_0_bytes, config)
 
     # fill mosaic
     for _ in range(10):
         response = client.post(
             f"/mosaic/{mosaic_id_0}/segment",
-            files={"file": ("filename", pil2bytes(np2pil(bright_portrait)), "image/jpeg")},
+            files={"file": ("filename", bright_portrait_bytes, "image/jpeg")},
         )
         assert response.status_code == 200
 
@@ -290,7 +298,7 @@ def test_mosaic_delete_next_3(prepare_db):
 def test_mosaic_delete_last(prepare_db):
     # pylint: disable=redefined-outer-name
     client, _ = prepare_db
-    mosaic_id_0 = create_mosaic(client, image_0, config)
+    mosaic_id_0 = create_mosaic(client, image_0_bytes, config)
 
     response = client.delete(f"/mosaic/{mosaic_id_0}")
     assert response.status_code == 200
@@ -303,15 +311,15 @@ def test_mosaic_fill_delete_add_fill_delete_delete_fill(prepare_db):
     config_2.title = "Test2"
     config_3 = config.copy()
     config_3.title = "Test3"
-    mosaic_id_0 = create_mosaic(client, image_0, config)
-    mosaic_id_1 = create_mosaic(client, image_0, config_2)
-    mosaic_id_2 = create_mosaic(client, image_0, config_3)
+    mosaic_id_0 = create_mosaic(client, image_0_bytes, config)
+    mosaic_id_1 = create_mosaic(client, image_0_bytes, config_2)
+    mosaic_id_2 = create_mosaic(client, image_0_bytes, config_3)
 
     # fill mosaic
     for _ in range(10):
         response = client.post(
             f"/mosaic/{mosaic_id_0}/segment",
-            files={"file": ("filename", pil2bytes(np2pil(bright_portrait)), "image/jpeg")},
+            files={"file": ("filename", bright_portrait_bytes, "image/jpeg")},
         )
         assert response.status_code == 200
 
@@ -322,7 +330,7 @@ def test_mosaic_fill_delete_add_fill_delete_delete_fill(prepare_db):
     for _ in range(10):
         response = client.post(
             f"/mosaic/{mosaic_id_2}/segment",
-            files={"file": ("filename", pil2bytes(np2pil(bright_portrait)), "image/jpeg")},
+            files={"file": ("filename", bright_portrait_bytes, "image/jpeg")},
         )
         assert response.status_code == 200
 
@@ -369,7 +377,7 @@ def test_mosaic_fill_delete_add_fill_delete_delete_fill(prepare_db):
     for _ in range(10):
         response = client.post(
             f"/mosaic/{metadata_4.id}/segment",
-            files={"file": ("filename", pil2bytes(np2pil(bright_portrait)), "image/jpeg")},
+            files={"file": ("filename", bright_portrait_bytes, "image/jpeg")},
         )
         assert response.status_code == 200
 
@@ -388,13 +396,13 @@ def test_mosaic_fill_delete_add_fill_delete_delete_fill(prepare_db):
 def test_mosaic_delete_last_original(prepare_db):
     # pylint: disable=redefined-outer-name
     client, db = prepare_db
-    mosaic_id_0 = create_mosaic(client, image_0, config)
+    mosaic_id_0 = create_mosaic(client, image_0_bytes, config)
 
     # fill mosaic 0
     for _ in range(10):
         response = client.post(
             f"/mosaic/{mosaic_id_0}/segment",
-            files={"file": ("filename", pil2bytes(np2pil(bright_portrait)), "image/jpeg")},
+            files={"file": ("filename", bright_portrait_bytes, "image/jpeg")},
         )
         assert response.status_code == 200
 
@@ -411,7 +419,7 @@ def test_mosaic_delete_last_original(prepare_db):
     for _ in range(10):
         response = client.post(
             f"/mosaic/{metadata_1.id}/segment",
-            files={"file": ("filename", pil2bytes(np2pil(bright_portrait)), "image/jpeg")},
+            files={"file": ("filename", bright_portrait_bytes, "image/jpeg")},
         )
         assert response.status_code == 200
 
@@ -423,36 +431,27 @@ def test_mosaic_delete_last_original(prepare_db):
     assert metadata_1.active is False
 
 
-def test_delete_multiple_actives(prepare_db):
+@pytest.fixture
+def four_actives(prepare_db):
     # pylint: disable=redefined-outer-name
+    # four mosaics (two originals, two copies) which are all (wrongly) marked as active
     client, db = prepare_db
-    mosaic_id_0 = create_mosaic(client, image_0, config)
-    mosaic_id_1 = create_mosaic(client, image_0, config)
-    mosaic_id_2 = create_mosaic(client, image_0, config)
-    mosaic_id_3 = create_mosaic(client, image_0, config)
-    meta_0 = db.read_mosaic_metadata(mosaic_id_0)
-    meta_0.active = True
-    meta_0.filled = False
-    meta_0.original = True
-    db.update_mosaic_metadata(meta_0)
-    meta_1 = db.read_mosaic_metadata(mosaic_id_1)
-    meta_1.active = True
-    meta_1.filled = False
-    meta_1.original = True
-    db.update_mosaic_metadata(meta_1)
-    meta_2 = db.read_mosaic_metadata(mosaic_id_2)
-    meta_2.active = True
-    meta_2.filled = False
-    meta_2.original = False
-    db.update_mosaic_metadata(meta_2)
-    meta_3 = db.read_mosaic_metadata(mosaic_id_3)
-    meta_3.active = True
-    meta_3.filled = False
-    meta_3.original = False
-    db.update_mosaic_metadata(meta_3)
+    mosaic_ids = [create_mosaic(client, image_0_bytes, config) for _ in range(4)]
+    for mosaic_id, original in zip(mosaic_ids, [True, True, False, False]):
+        meta = db.read_mosaic_metadata(mosaic_id)
+        meta.active = True
+        meta.filled = False
+        meta.original = original
+        db.update_mosaic_metadata(meta)
+    return client, db, mosaic_ids
+
+
+def test_delete_multiple_actives(four_actives):
+    # pylint: disable=redefined-outer-name
+    client, db, mosaic_ids = four_actives
 
     # delete mosaic 1
-    response = client.delete(f"/mosaic/{mosaic_id_1}")
+    response = client.delete(f"/mosaic/{mosaic_ids[1]}")
     assert response.status_code == 200
 
     mosaics = db.read_mosaic_list()
@@ -464,39 +463,15 @@ def test_delete_multiple_actives(prepare_db):
     assert mosaics[2][5] == 0
 
 
-def test_fill_multiple_actives(prepare_db):
+def test_fill_multiple_actives(four_actives):
     # pylint: disable=redefined-outer-name
-    client, db = prepare_db
-    mosaic_id_0 = create_mosaic(client, image_0, config)
-    mosaic_id_1 = create_mosaic(client, image_0, config)
-    mosaic_id_2 = create_mosaic(client, image_0, config)
-    mosaic_id_3 = create_mosaic(client, image_0, config)
-    meta_0 = db.read_mosaic_metadata(mosaic_id_0)
-    meta_0.active = True
-    meta_0.filled = False
-    meta_0.original = True
-    db.update_mosaic_metadata(meta_0)
-    meta_1 = db.read_mosaic_metadata(mosaic_id_1)
-    meta_1.active = True
-    meta_1.filled = False
-    meta_1.original = True
-    db.update_mosaic_metadata(meta_1)
-    meta_2 = db.read_mosaic_metadata(mosaic_id_2)
-    meta_2.active = True
-    meta_2.filled = False
-    meta_2.original = False
-    db.update_mosaic_metadata(meta_2)
-    meta_3 = db.read_mosaic_metadata(mosaic_id_3)
-    meta_3.active = True
-    meta_3.filled = False
-    meta_3.original = False
-    db.update_mosaic_metadata(meta_3)
+    client, db, mosaic_ids = four_actives
 
     # fill mosaic 2
     for _ in range(10):
         response = client.post(
-            f"/mosaic/{meta_2.id}/segment",
-            files={"file": ("filename", pil2bytes(np2pil(bright_portrait)), "image/jpeg")},
+            f"/mosaic/{mosaic_ids[2]}/segment",
+            files={"file": ("filename", bright_portrait_bytes, "image/jpeg")},
         )
         assert response.status_code == 200
 
@@ -511,48 +486,24 @@ def test_fill_multiple_actives(prepare_db):
     assert mosaics[3][5] == 0
 
 
-def test_correct_multiple_actives(prepare_db):
+def test_correct_multiple_actives(four_actives):
     # pylint: disable=redefined-outer-name
-    client, db = prepare_db
-    mosaic_id_0 = create_mosaic(client, image_0, config)
-    mosaic_id_1 = create_mosaic(client, image_0, config)
-    mosaic_id_2 = create_mosaic(client, image_0, config)
-    mosaic_id_3 = create_mosaic(client, image_0, config)
-    meta_0 = db.read_mosaic_metadata(mosaic_id_0)
-    meta_0.active = True
-    meta_0.filled = False
-    meta_0.original = True
-    db.update_mosaic_metadata(meta_0)
-    meta_1 = db.read_mosaic_metadata(mosaic_id_1)
-    meta_1.active = True
-    meta_1.filled = False
-    meta_1.original = True
-    db.update_mosaic_metadata(meta_1)
-    meta_2 = db.read_mosaic_metadata(mosaic_id_2)
-    meta_2.active = True
-    meta_2.filled = False
-    meta_2.original = False
-    db.update_mosaic_metadata(meta_2)
-    meta_3 = db.read_mosaic_metadata(mosaic_id_3)
-    meta_3.active = True
-    meta_3.filled = False
-    meta_3.original = False
-    db.update_mosaic_metadata(meta_3)
+    client, db, mosaic_ids = four_actives
 
     response = client.post(
-        f"/mosaic/{mosaic_id_1}/states",
+        f"/mosaic/{mosaic_ids[1]}/states",
         data={"active": False, "filled": False, "original": True},
     )
     assert response.status_code == 200
 
     response = client.post(
-        f"/mosaic/{mosaic_id_2}/states",
+        f"/mosaic/{mosaic_ids[2]}/states",
         data={"active": False, "filled": False, "original": False},
     )
     assert response.status_code == 200
 
     response = client.post(
-        f"/mosaic/{mosaic_id_3}/states",
+        f"/mosaic/{mosaic_ids[3]}/states",
         data={"active": False, "filled": False, "original": False},
     )
     assert response.status_code == 200
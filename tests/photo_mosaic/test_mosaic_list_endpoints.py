@@ -1,8 +1,5 @@
-import os
-
 import numpy as np
 import pytest
-from fastapi.testclient import TestClient
 
 from photo_mosaic.models.mosaic_config import MosaicConfig
 from photo_mosaic.models.mosaic_metadata import MosaicMetadata
@@ -73,26 +70,16 @@ image_0 = np.zeros((SEGMENT_HEIGHT * N_ROWS, SEGMENT_WIDTH * N_COLS, 3), dtype="
 image_1 = np.ones((SEGMENT_HEIGHT * N_ROWS, SEGMENT_WIDTH * N_COLS, 3), dtype="uint8")
 cur_jpeg_0 = RawImage(mosaic_id=m_0.id, category=RAW_IMAGE_CURRENT_JPEG, image_bytes=pil2bytes(np2pil(image_0)))
 cur_jpeg_1 = RawImage(mosaic_id=m_1.id, category=RAW_IMAGE_CURRENT_JPEG, image_bytes=pil2bytes(np2pil(image_1)))
-image_small_0 = np2pil(image_0.copy())
-image_small_1 = np2pil(image_1.copy())
-image_small_0.thumbnail((512, 512))
-image_small_1.thumbnail((512, 512))
-image_small_0 = pil2np(image_small_0)
-image_small_1 = pil2np(image_small_1)
-cur_jpeg_small_0 = RawImage(
-    mosaic_id=m_0.id, category=RAW_IMAGE_CURRENT_SMALL_JPEG, image_bytes=pil2bytes(np2pil(image_small_0))
-)
-cur_jpeg_small_1 = RawImage(
-    mosaic_id=m_1.id, category=RAW_IMAGE_CURRENT_SMALL_JPEG, image_bytes=pil2bytes(np2pil(image_small_1))
-)
+# the images already fit into the 512x512 thumbnail size, so the thumbnails are identical to the images
+image_small_0 = image_0
+image_small_1 = image_1
+cur_jpeg_small_0 = RawImage(mosaic_id=m_0.id, category=RAW_IMAGE_CURRENT_SMALL_JPEG, image_bytes=cur_jpeg_0.image_bytes)
+cur_jpeg_small_1 = RawImage(mosaic_id=m_1.id, category=RAW_IMAGE_CURRENT_SMALL_JPEG, image_bytes=cur_jpeg_1.image_bytes)
 
 
-@pytest.fixture(scope="function")
-def prepare_db(request, tmp_path):
-    db_path = tmp_path / "db"
-    db_path.mkdir()
-    os.environ["SQLITE_PATH"] = str(db_path)
-
+@pytest.fixture(scope="module")
+def prepare_db(request, client):
+    # the tests of this module only read, so the mosaics are written once
     from photo_mosaic.services.persistence import db
 
     db.connect()
@@ -104,10 +91,6 @@ def prepare_db(request, tmp_path):
     db.upsert_raw_image(cur_jpeg_small_1)
     db.commit()
 
-    from photo_mosaic.app import app
-
-    client = TestClient(app)
-
     def teardown_db():
         db.delete_mosaic_metadata(m_0.id)
         db.delete_mosaic_metadata(m_1.id)
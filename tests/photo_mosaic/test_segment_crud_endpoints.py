@@ -1,8 +1,5 @@
-import os
-
 import numpy as np
 import pytest
-from fastapi.testclient import TestClient
 
 from photo_mosaic.models.mosaic_config import MosaicConfig
 from photo_mosaic.models.mosaic_metadata import MosaicMetadata
@@ -119,11 +116,7 @@ filling_gif_0 = RawImage(mosaic_id=m_0.id, category=RAW_IMAGE_FILLING_GIF, image
 
 
 @pytest.fixture(scope="function")
-def prepare_db(request, tmp_path):
-    db_path = tmp_path / "db"
-    db_path.mkdir()
-    os.environ["SQLITE_PATH"] = str(db_path)
-
+def prepare_db(request, client):
     from photo_mosaic.services.persistence import db
 
     db.connect()
@@ -135,10 +128,6 @@ def prepare_db(request, tmp_path):
     db.upsert_segments([s_0, s_1, s_2, s_3])
     db.commit()
 
-    from photo_mosaic.app import app
-
-    client = TestClient(app)
-
     def teardown_db():
         db.delete_mosaic_metadata(m_0.id)
         db.commit()
@@ -150,12 +139,7 @@ def prepare_db(request, tmp_path):
 
 def test_list_segments(prepare_db):
     # pylint: disable=redefined-outer-name
-    client, db = prepare_db
-    db.connect()
-    db.insert_mosaic_metadata(m_0)
-    db.upsert_segments([s_0, s_1, s_2, s_3])
-    db.commit()
-
+    client, _ = prepare_db
     response = client.get(f"/mosaic/{m_0.id}/segment/list")
     assert response.status_code == 200
     expected_res = {